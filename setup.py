@@ -9,7 +9,6 @@ setup(
 	packages = ['termsplit'],
 	install_requires = [
 		'gevent',
-		'inputdev',
 		'argh',
 		'monotonic',
 		'gtools',
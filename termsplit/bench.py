@@ -0,0 +1,82 @@
+
+import os
+import struct
+import time
+
+import gevent
+import gevent.queue
+import gevent.socket
+from monotonic import monotonic
+
+from termsplit.readers import add_reader
+
+
+TIMESTAMP = struct.Struct('d')
+
+
+def percentile(values, fraction):
+	"""Return the value which fraction of the (sorted) values are at or below"""
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _read_timestamps(fd, buffer, queue):
+	"""Read what's available from fd, putting any complete timestamps to queue.
+	buffer is a one-item list holding any partial timestamp left over from last time."""
+	data = buffer[0] + os.read(fd, TIMESTAMP.size * 64)
+	end = len(data) - len(data) % TIMESTAMP.size
+	for offset in range(0, end, TIMESTAMP.size):
+		queue.put(TIMESTAMP.unpack_from(data, offset)[0])
+	buffer[0] = data[end:]
+
+
+def _greenlet_reader(fd, queue):
+	buffer = ['']
+	while True:
+		gevent.socket.wait_read(fd)
+		_read_timestamps(fd, buffer, queue)
+
+
+def input_latency(backend, count=1000, interval=0.001):
+	"""Measure how long it takes input to go from being written to a pipe, to being consumed from a queue.
+	backend is how the pipe is read:
+		greenlet: a greenlet waiting for the fd to be readable in a loop
+		callback: a callback run by the event loop when the fd is readable (see add_reader())
+	The input is written by a child process, count times at the given interval,
+	so that writing doesn't compete with reading for our event loop.
+	Returns (sorted list of latencies, cpu time used by this process)."""
+	read_fd, write_fd = os.pipe()
+	pid = os.fork()
+	if not pid:
+		# child: write timestamps, then exit
+		try:
+			os.close(read_fd)
+			time.sleep(0.1) # give the parent time to start reading
+			for _ in range(count):
+				os.write(write_fd, TIMESTAMP.pack(monotonic()))
+				time.sleep(interval)
+		finally:
+			os._exit(0)
+	os.close(write_fd)
+
+	queue = gevent.queue.Queue()
+	if backend == 'greenlet':
+		reader = gevent.spawn(_greenlet_reader, read_fd, queue)
+		stop = reader.kill
+	elif backend == 'callback':
+		watcher = add_reader(read_fd, _read_timestamps, read_fd, [''], queue)
+		stop = watcher.stop
+	else:
+		raise ValueError('Unknown backend: {!r}'.format(backend))
+
+	start_cpu = sum(os.times()[:2])
+	latencies = []
+	try:
+		for _ in range(count):
+			timestamp = queue.get()
+			latencies.append(monotonic() - timestamp)
+	finally:
+		cpu = sum(os.times()[:2]) - start_cpu
+		stop()
+		os.close(read_fd)
+		os.waitpid(pid, 0)
+	return sorted(latencies), cpu
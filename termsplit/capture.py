@@ -0,0 +1,143 @@
+
+import os
+import sys
+import errno
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import traceback
+
+from termsplit.keycodes import KEYCODES
+from termsplit.evdev import EV_KEY, GONE_ERRNOS, KEY_DOWN, KeyDevices
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+RECORD = struct.Struct('=qH') # timestamp, key code
+PR_SET_PDEATHSIG = 1
+SCHED_FIFO = 1
+FIFO_PRIORITY = 10 # low as realtime priorities go, but above all normal processes
+NICENESS = -10 # used if we can't get realtime priority
+
+
+def _raise_priority():
+	"""Try to get realtime scheduling, or failing that a higher priority. Failures are ignored,
+	as they'll usually be due to lacking permission and we can still work without."""
+	param = ctypes.c_int(FIFO_PRIORITY)
+	if _libc.sched_setscheduler(0, SCHED_FIFO, ctypes.byref(param)) == 0:
+		return
+	try:
+		os.nice(NICENESS)
+	except OSError:
+		pass
+
+
+class _Capture(object):
+	"""The capture process's side: read key presses from all devices and write them to the pipe.
+	Blocking and single-threaded, and doesn't use gevent at all."""
+
+	def __init__(self, pipe):
+		self.pipe = pipe
+		self.devices = KeyDevices()
+
+	def run(self):
+		while True:
+			by_fd = {device.fd: device for device in self.devices.devices.values()}
+			fds = list(by_fd)
+			inotify = self.devices.inotify
+			if inotify:
+				fds.append(inotify.fd)
+			try:
+				readable, _, _ = select.select(fds, [], [])
+			except select.error as ex:
+				if ex.args[0] != errno.EINTR:
+					raise
+				continue
+			for fd in readable:
+				if inotify and fd == inotify.fd:
+					self.devices.update()
+				elif fd in by_fd and by_fd[fd].fd is not None: # may have been removed by an earlier update()
+					self.read_device(by_fd[fd])
+
+	def read_device(self, device):
+		try:
+			events = device.read_available()
+		except EnvironmentError as ex:
+			if ex.errno not in GONE_ERRNOS:
+				raise
+			self.devices.remove(device.name) # unplugged, we'll add it again if it comes back
+			return
+		data = ''.join(
+			RECORD.pack(timestamp, code)
+			for timestamp, type, code, value in events
+			if type == EV_KEY and value == KEY_DOWN and code in KEYCODES
+		)
+		# records are much smaller than PIPE_BUF, so each write is atomic and completes in full
+		if data:
+			os.write(self.pipe, data)
+
+
+class CaptureProcess(object):
+	"""Reads key presses in a dedicated process, so that nothing the main process does
+	(rendering, saving, garbage collection, or anything else holding the GIL) can delay them.
+	Presses are timestamped by the kernel (see EventDevice) and passed back as fixed-size records over a pipe.
+	If priority is set, the process tries to get realtime scheduling, or failing that a better niceness.
+	Read the pipe with read_available() whenever fd is readable."""
+
+	def __init__(self, priority=False):
+		read_fd, write_fd = os.pipe()
+		self.pid = os.fork()
+		if not self.pid:
+			# child
+			try:
+				os.close(read_fd)
+				_libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM) # don't outlive our parent
+				signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl-c is for our parent to handle
+				if priority:
+					_raise_priority()
+				_Capture(write_fd).run()
+			except EnvironmentError as ex:
+				if ex.errno != errno.EPIPE: # parent has gone away
+					traceback.print_exc()
+			except BaseException:
+				traceback.print_exc()
+			finally:
+				sys.stderr.flush()
+				os._exit(1)
+		os.close(write_fd)
+		self.fd = read_fd
+		self.buffer = ''
+
+	def read_available(self):
+		"""Read and return a list of (key name, timestamp) of available presses.
+		Raises EOFError if the capture process has exited."""
+		try:
+			data = os.read(self.fd, RECORD.size * 64)
+		except OSError as ex:
+			if ex.errno in (errno.EAGAIN, errno.EINTR):
+				return []
+			raise
+		if not data:
+			raise EOFError('Input capture process exited')
+		data = self.buffer + data
+		end = len(data) - len(data) % RECORD.size
+		self.buffer = data[end:]
+		presses = []
+		for offset in range(0, end, RECORD.size):
+			timestamp, code = RECORD.unpack_from(data, offset)
+			presses.append((KEYCODES[code], timestamp))
+		return presses
+
+	def close(self):
+		if self.fd is None:
+			return
+		os.close(self.fd)
+		self.fd = None
+		try:
+			os.kill(self.pid, signal.SIGTERM)
+			os.waitpid(self.pid, 0)
+		except OSError as ex:
+			if ex.errno not in (errno.ESRCH, errno.ECHILD):
+				raise
@@ -0,0 +1,26 @@
+
+from collections import OrderedDict
+
+
+# Columns of the results table, after the name.
+# Each shows either the segment time or the total time of a result,
+# either as-is (reference is None) or compared against a reference time (see UI.get_references()).
+# Headers are formatted with the name of the current comparison (see Comparisons).
+COLUMNS = OrderedDict([
+	# name: (header, value, reference)
+	('seg', ('Seg Time', 'seg', None)),
+	('best_seg', ('Best Seg', 'seg', 'best_seg')),
+	('pb_seg', ('PB Seg', 'seg', 'pb_seg')),
+	('time', ('Time', 'time', None)),
+	('pb_time', ('PB Time', 'time', 'pb_time')),
+	('sum_of_best', ('Sum of Best', 'time', 'sum_of_best')),
+	('comparison_seg', ('{} Seg', 'seg', 'comparison_seg')),
+	('comparison_time', ('{} Time', 'time', 'comparison_time')),
+])
+
+DEFAULT_COLUMNS = ('seg', 'best_seg', 'comparison_seg', 'time', 'comparison_time')
+
+
+def row_format(widths):
+	"""Return a format string for a row of strings with the given column widths"""
+	return '  '.join('{{:<{}}}'.format(width) for width in widths)
@@ -0,0 +1,118 @@
+
+from collections import OrderedDict
+
+from termsplit.history import usable_segments
+
+# What the current run can be compared against, and their short names for column headers.
+# In addition, attempt:N compares against the Nth attempt in the history (counting from 1).
+TARGETS = OrderedDict([
+	('pb', 'PB'), # the best run
+	('sum_of_best', 'SoB'), # best segments
+	('average', 'Avg'), # mean of each segment's sketch
+	('median', 'Median'), # median of each segment's sketch
+	('latest', 'Latest'), # most recent attempt
+])
+
+DEFAULT_TARGETS = tuple(TARGETS)
+
+
+def check_target(target):
+	"""Raise ValueError if target isn't a valid comparison target"""
+	if target in TARGETS:
+		return
+	kind, _, number = target.partition(':')
+	if kind != 'attempt' or not number.isdigit() or not int(number):
+		raise ValueError('Unknown comparison {!r}, expected one of {} or attempt:N'.format(target, ', '.join(TARGETS)))
+
+
+def target_name(target):
+	if target in TARGETS:
+		return TARGETS[target]
+	return '#{}'.format(target.partition(':')[2])
+
+
+def running_totals(segments):
+	"""Return the running totals of a list of segment times, which are None from the first unknown segment on"""
+	times = []
+	total = 0
+	for segment in segments:
+		total = None if total is None or segment is None else total + segment
+		times.append(total)
+	return times
+
+
+def attempt_times(segments, length):
+	"""Return (segment times, cumulative times) of an attempt, as recorded in the history, padded to length.
+	A skipped segment is None, and is timed together with the following segment. So the following segment's
+	time is not comparable (and is made None), but the cumulative time after it is still known."""
+	segments = list(segments)[:length]
+	segments += [None] * (length - len(segments))
+	times = []
+	total = 0
+	for segment in segments:
+		if segment is not None:
+			total += segment
+		times.append(None if segment is None else total)
+	return usable_segments(segments), times
+
+
+class Comparisons(object):
+	"""The comparison targets available to cycle through, which one is current,
+	and the precomputed (segment times, cumulative times) of recently used targets.
+
+	A target's times are computed from the splits (and history) when it is first needed,
+	and re-used until the splits change. Up to MAX_CACHED targets are kept, least recently used first out,
+	so cycling back and forth doesn't recompute anything."""
+	MAX_CACHED = 4
+
+	def __init__(self, targets=DEFAULT_TARGETS, history=None):
+		self.targets = targets
+		self.history = history
+		self.index = 0
+		self._cache = OrderedDict() # {target: (splits, version, (segments, times))}
+
+	@property
+	def current(self):
+		return self.targets[self.index]
+
+	@property
+	def name(self):
+		return target_name(self.current)
+
+	def cycle(self):
+		"""Switch to the next target"""
+		self.index = (self.index + 1) % len(self.targets)
+
+	def get(self, splits, target=None):
+		"""Return (list of segment times, list of cumulative times) of the given target (default current)
+		for each of the given splits' segments, with None where unknown."""
+		target = target or self.current
+		if target in self._cache:
+			cached_splits, version, arrays = self._cache.pop(target)
+			if cached_splits is splits and version == splits.version:
+				self._cache[target] = cached_splits, version, arrays # now most recently used
+				return arrays
+		arrays = self.compute(splits, target)
+		self._cache[target] = splits, splits.version, arrays
+		while len(self._cache) > self.MAX_CACHED:
+			self._cache.popitem(last=False)
+		return arrays
+
+	def compute(self, splits, target):
+		if target == 'pb':
+			return (
+				[splits.best_run_segment_time(index) for index in range(len(splits))],
+				[time for name, best, time in splits],
+			)
+		if target == 'sum_of_best':
+			segments = [best for name, best, time in splits]
+		elif target == 'average':
+			segments = [sketch.mean() if sketch else None for sketch in splits.sketches]
+		elif target == 'median':
+			segments = [sketch.median() if sketch else None for sketch in splits.sketches]
+		else:
+			attempt = None
+			if self.history:
+				attempt = self.history.attempt(-1 if target == 'latest' else int(target.partition(':')[2]))
+			return attempt_times(attempt or [], len(splits))
+		return segments, running_totals(segments)
@@ -0,0 +1,117 @@
+
+import os
+import json
+from collections import OrderedDict
+
+from termsplit.keycodes import KEYCODES
+from termsplit.keys import KEYPRESS_EVENTS
+from termsplit.columns import COLUMNS, DEFAULT_COLUMNS
+from termsplit.comparisons import DEFAULT_TARGETS, check_target
+
+
+DEFAULT_PATH = os.path.expanduser('~/.termsplit.json')
+
+KEY_NAMES = frozenset(KEYCODES.values())
+
+# {option type: JSON values accepted for it}. Values are checked rather than coerced,
+# as eg. bool("false") is True and int(2.7) is 2.
+JSON_TYPES = {
+	float: (int, long, float),
+	int: (int, long),
+	tuple: (list,),
+	bool: (bool,),
+}
+
+
+class Config(object):
+	"""A config file, validated once and compiled into the lookups the UI needs at runtime.
+
+	The file is a JSON object. Keys named after actions (see KEYPRESS_EVENTS) give the name
+	of the key bound to that action (see KEYCODES). Other keys are options, see OPTIONS.
+	"""
+	OPTIONS = OrderedDict([
+		# name: (type, default, description)
+		('refresh_rate', (float, 100., 'Screen updates per second while the timer is running')),
+		('precision', (int, 3, 'Number of decimal places to show for times')),
+		('columns', (tuple, DEFAULT_COLUMNS, 'Columns of the results table to show, in order (see COLUMNS)')),
+		('comparisons', (tuple, DEFAULT_TARGETS, 'What to compare against, in the order COMPARE cycles through them')),
+		('collapse_groups', (bool, True, 'Show each finished group of splits as a single row of results')),
+	])
+
+	_cache = {} # {path: ((mtime, size), Config)}
+
+	def __init__(self, data=None):
+		"""Validate and compile the given decoded config file. Raises ValueError if invalid."""
+		data = data or {}
+		if not isinstance(data, dict):
+			raise ValueError('Config must be a JSON object')
+		unknown = set(data) - set(KEYPRESS_EVENTS) - set(self.OPTIONS)
+		if unknown:
+			raise ValueError('Unknown config keys: {}'.format(', '.join(sorted(unknown))))
+		self.bindings = OrderedDict() # {action: key name}, in the order of KEYPRESS_EVENTS
+		self.key_actions = {} # {key name: action}
+		for action in KEYPRESS_EVENTS:
+			if action in data:
+				self.bind(action, data[action])
+		for name, (type, default, description) in self.OPTIONS.items():
+			value = data.get(name, default)
+			if name in data and not (
+				isinstance(value, JSON_TYPES[type])
+				and (type is bool or not isinstance(value, bool)) # bool is a subclass of int
+				and (type is not tuple or all(isinstance(item, basestring) for item in value))
+			):
+				raise ValueError('Bad value for {}: {!r}'.format(name, value))
+			setattr(self, name, type(value))
+		if self.refresh_rate <= 0:
+			raise ValueError('refresh_rate must be positive')
+		if not 0 <= self.precision <= 9:
+			raise ValueError('precision must be between 0 and 9')
+		if not set(self.columns) <= set(COLUMNS):
+			raise ValueError('columns must be a list of: {}'.format(', '.join(COLUMNS)))
+		if not self.comparisons:
+			raise ValueError('comparisons must be a non-empty list')
+		for target in self.comparisons:
+			check_target(target)
+
+	def bind(self, action, key):
+		if key not in KEY_NAMES:
+			raise ValueError('Unknown key name for {}: {!r}'.format(action, key))
+		old_key = self.bindings.get(action)
+		if self.key_actions.get(old_key) == action:
+			del self.key_actions[old_key]
+		self.bindings[action] = key
+		self.key_actions[key] = action
+
+	@property
+	def interval(self):
+		"""Time between screen updates"""
+		return 1 / self.refresh_rate
+
+	def dump(self):
+		data = OrderedDict(self.bindings)
+		for name, (type, default, description) in self.OPTIONS.items():
+			if getattr(self, name) != default:
+				data[name] = getattr(self, name)
+		return json.dumps(data, indent=4)
+
+	@classmethod
+	def load(cls, path=None):
+		"""Load a config file, default ~/.termsplit.json.
+		The result is cached, and re-used as long as the file hasn't changed."""
+		path = path or DEFAULT_PATH
+		stat = os.stat(path)
+		key = stat.st_mtime, stat.st_size
+		cached_key, config = cls._cache.get(path, (None, None))
+		if cached_key == key:
+			return config
+		with open(path) as f:
+			config = cls(json.loads(f.read()))
+		cls._cache[path] = key, config
+		return config
+
+	def save(self, path=None):
+		path = path or DEFAULT_PATH
+		with open(path, 'w') as f:
+			f.write(self.dump() + '\n')
+		stat = os.stat(path)
+		self._cache[path] = (stat.st_mtime, stat.st_size), self
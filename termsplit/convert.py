@@ -0,0 +1,154 @@
+
+import os
+import json
+import errno
+import select
+import multiprocessing
+
+from termsplit.splits import Splits
+
+
+def check_splits(splits):
+	"""Return a list of warnings about inconsistencies in the given splits"""
+	warnings = []
+	last_time = 0
+	for index, (name, best, time) in enumerate(splits):
+		if time is not None:
+			if time < last_time:
+				warnings.append('{!r}: best run time goes backwards'.format(name))
+			last_time = time
+		pb_seg = splits.best_run_segment_time(index)
+		if best is not None and pb_seg is not None and pb_seg < best:
+			warnings.append('{!r}: best run segment is faster than best segment'.format(name))
+	return warnings
+
+
+def process_file(path, output=None):
+	"""Parse and check a single splitfile. If output is given, write the normalized splits there.
+	Returns a small summary dict rather than the splits themselves, so that results
+	can be streamed back to the parent without holding every file in memory."""
+	result = {'path': path, 'output': output, 'segments': 0, 'changed': False, 'error': None, 'warnings': []}
+	try:
+		with open(path) as f:
+			data = f.read()
+		splits = Splits()
+		splits.load(data)
+		result['segments'] = len(splits)
+		result['warnings'] = check_splits(splits)
+		normalized = splits.dump() + '\n'
+		result['changed'] = normalized != data
+		if output is not None and (result['changed'] or os.path.abspath(output) != os.path.abspath(path)):
+			tmp = '{}.tmp'.format(output)
+			with open(tmp, 'w') as f:
+				f.write(normalized)
+			os.rename(tmp, output)
+	except (EnvironmentError, ValueError) as ex:
+		result['error'] = str(ex)
+	return result
+
+
+class _Worker(object):
+	"""Parent's handle on a worker process. Work items and results are passed as lines of JSON
+	over a pair of pipes."""
+
+	def __init__(self, func, others):
+		request_read, request_write = os.pipe()
+		result_read, result_write = os.pipe()
+		self.pid = os.fork()
+		if not self.pid:
+			# child: close everything belonging to the parent or other workers, so they see EOF correctly
+			os.close(request_write)
+			os.close(result_read)
+			for other in others:
+				other.close()
+			try:
+				self._serve(func, os.fdopen(request_read), os.fdopen(result_write, 'w'))
+			finally:
+				os._exit(0)
+		os.close(request_read)
+		os.close(result_write)
+		self.requests = request_write
+		self.results = result_read
+		self.buffer = ''
+		self.in_flight = 0
+
+	@staticmethod
+	def _serve(func, requests, results):
+		for line in iter(requests.readline, ''):
+			results.write(json.dumps(func(*json.loads(line))) + '\n')
+			results.flush()
+
+	def send(self, args):
+		data = json.dumps(args) + '\n'
+		while data:
+			data = data[os.write(self.requests, data):]
+		self.in_flight += 1
+
+	def receive(self):
+		"""Read whatever results are available, returning a list of them"""
+		data = os.read(self.results, 64 * 1024)
+		if not data:
+			raise EOFError('Worker {} exited unexpectedly'.format(self.pid))
+		lines = (self.buffer + data).split('\n')
+		self.buffer = lines.pop()
+		self.in_flight -= len(lines)
+		return [json.loads(line) for line in lines]
+
+	def finish(self):
+		"""Tell the worker there's no more work"""
+		if self.requests is not None:
+			os.close(self.requests)
+			self.requests = None
+
+	def close(self):
+		self.finish()
+		os.close(self.results)
+
+	def wait(self):
+		try:
+			os.waitpid(self.pid, 0)
+		except OSError as ex:
+			if ex.errno != errno.ECHILD:
+				raise
+
+
+def process_map(func, arglists, jobs=None):
+	"""Call func(*args) for each args in arglists across jobs worker processes (default one per core),
+	yielding results as they become available, in no particular order.
+	Arguments and results must be JSON-serializable.
+	Work is handed out on demand, with a couple of items in flight per worker,
+	so workers stay busy even if some items take much longer than others.
+
+	We don't use multiprocessing.Pool as it waits forever if a worker process dies (eg. is OOM-killed),
+	whereas here that raises EOFError."""
+	jobs = jobs or multiprocessing.cpu_count()
+	arglists = iter(arglists)
+	workers = []
+	for _ in range(jobs):
+		workers.append(_Worker(func, workers))
+
+	def feed(worker):
+		for args in arglists:
+			worker.send(args)
+			return
+		worker.finish()
+
+	try:
+		for worker in workers:
+			feed(worker)
+			feed(worker)
+		while True:
+			active = {worker.results: worker for worker in workers if worker.in_flight}
+			if not active:
+				break
+			readable, _, _ = select.select(list(active), [], [])
+			for fd in readable:
+				worker = active[fd]
+				for result in worker.receive():
+					feed(worker)
+					yield result
+	finally:
+		for worker in workers:
+			worker.close()
+		for worker in workers:
+			worker.wait()
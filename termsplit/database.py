@@ -0,0 +1,167 @@
+
+import os
+import sqlite3
+from itertools import groupby
+
+from termsplit.history import History, usable_segments
+from termsplit.journal import wall_ns
+from termsplit.sketch import QuantileSketch
+
+
+# splitfiles with these extensions are stored as a database rather than as text
+EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+SCHEMA = """
+	CREATE TABLE IF NOT EXISTS segments (
+		position INTEGER PRIMARY KEY, -- index of the split
+		name TEXT NOT NULL,
+		best INTEGER, -- times are in nanoseconds, NULL if unknown
+		pb_time INTEGER,
+		sketch TEXT -- serialized QuantileSketch
+	);
+	CREATE TABLE IF NOT EXISTS groups (
+		position INTEGER PRIMARY KEY, -- in the order of Splits.groups
+		name TEXT NOT NULL,
+		start INTEGER NOT NULL,
+		stop INTEGER NOT NULL,
+		depth INTEGER NOT NULL
+	);
+	CREATE TABLE IF NOT EXISTS attempts (
+		id INTEGER PRIMARY KEY, -- attempts are numbered from 1, in the order they were made
+		recorded INTEGER NOT NULL, -- wall clock time, in nanoseconds since the epoch
+		reached INTEGER NOT NULL, -- number of segments completed or skipped
+		total INTEGER -- final time, or NULL if the attempt was not completed
+	);
+	CREATE TABLE IF NOT EXISTS segment_times (
+		attempt INTEGER NOT NULL REFERENCES attempts (id),
+		segment INTEGER NOT NULL,
+		time INTEGER, -- NULL if skipped
+		gold INTEGER NOT NULL, -- whether it beat every earlier time for the segment
+		PRIMARY KEY (attempt, segment)
+	);
+	CREATE INDEX IF NOT EXISTS best_attempts ON attempts (total) WHERE total IS NOT NULL;
+	CREATE INDEX IF NOT EXISTS attempts_reached ON attempts (reached);
+	CREATE INDEX IF NOT EXISTS golds ON segment_times (segment, attempt, time) WHERE gold;
+"""
+
+
+def is_database(filepath):
+	return os.path.splitext(filepath)[1] in EXTENSIONS
+
+
+class Database(object):
+	"""Splits and their attempt history, stored in a sqlite database so that they can be queried
+	without parsing everything. See SCHEMA.
+	Splits are read and written as a whole, see load() and save(). History is in DatabaseHistory."""
+
+	def __init__(self, path):
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.text_factory = str
+		self.connection.executescript(SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	def load(self):
+		"""Return (rows, sketches, groups) of the stored splits, as per Splits"""
+		rows = []
+		sketches = []
+		for name, best, pb_time, sketch in self.connection.execute(
+			'SELECT name, best, pb_time, sketch FROM segments ORDER BY position'
+		):
+			rows.append((intern(name), best, pb_time))
+			sketches.append(QuantileSketch.parse(sketch) if sketch else None)
+		groups = [
+			(intern(name), start, stop, depth)
+			for name, start, stop, depth in self.connection.execute(
+				'SELECT name, start, stop, depth FROM groups ORDER BY position'
+			)
+		]
+		return rows, sketches, groups
+
+	def save(self, splits):
+		"""Replace the stored splits, in a single transaction"""
+		with self.connection:
+			self.connection.execute('DELETE FROM segments')
+			self.connection.execute('DELETE FROM groups')
+			self.connection.executemany('INSERT INTO segments VALUES (?, ?, ?, ?, ?)', (
+				(position, name, best, pb_time, sketch.serialize() if sketch else None)
+				for position, ((name, best, pb_time), sketch) in enumerate(zip(splits, splits.sketches))
+			))
+			self.connection.executemany('INSERT INTO groups VALUES (?, ?, ?, ?, ?)', (
+				(position,) + group for position, group in enumerate(splits.groups)
+			))
+
+
+class DatabaseHistory(History):
+	"""History of attempts, kept in the splitfile's Database rather than alongside it.
+	As well as the History interface, it can answer queries about attempts using the database's indexes."""
+
+	def __init__(self, database):
+		self.database = database
+
+	def __iter__(self):
+		rows = self.database.connection.execute(
+			'SELECT attempt, time FROM segment_times ORDER BY attempt, segment'
+		)
+		for attempt, times in groupby(rows, lambda row: row[0]):
+			yield [time for attempt, time in times]
+
+	def attempt(self, number):
+		connection = self.database.connection
+		if number > 0:
+			found = connection.execute('SELECT id FROM attempts WHERE id = ?', (number,)).fetchone()
+		else:
+			found = connection.execute(
+				'SELECT id FROM attempts ORDER BY id DESC LIMIT 1 OFFSET ?', (-number - 1,)
+			).fetchone()
+		if not found:
+			return None
+		return [time for time, in connection.execute(
+			'SELECT time FROM segment_times WHERE attempt = ? ORDER BY segment', found
+		)]
+
+	def append(self, segments):
+		"""Record an attempt, given its segment times, in a single transaction.
+		The attempt is completed if it has a time for every saved split."""
+		connection = self.database.connection
+		with connection:
+			(num_segments,), = connection.execute('SELECT count(*) FROM segments')
+			total = None
+			if len(segments) == num_segments and segments[-1] is not None:
+				total = sum(segment for segment in segments if segment is not None)
+			attempt = connection.execute(
+				'INSERT INTO attempts (recorded, reached, total) VALUES (?, ?, ?)',
+				(wall_ns(), len(segments), total),
+			).lastrowid
+			rows = []
+			for index, (segment, usable) in enumerate(zip(segments, usable_segments(segments))):
+				gold = usable is not None
+				if gold:
+					(best,), = connection.execute(
+						'SELECT min(time) FROM segment_times WHERE segment = ? AND gold', (index,)
+					)
+					gold = best is None or usable < best
+				rows.append((attempt, index, segment, gold))
+			connection.executemany('INSERT INTO segment_times VALUES (?, ?, ?, ?)', rows)
+
+	def best_attempts(self, count):
+		"""Return (attempt number, when recorded, final time) of the count fastest completed attempts"""
+		return self.database.connection.execute(
+			'SELECT id, recorded, total FROM attempts WHERE total IS NOT NULL ORDER BY total LIMIT ?', (count,)
+		).fetchall()
+
+	def golds(self, segment=None):
+		"""Return (segment, attempt number, time) for every time a segment's best time was beaten,
+		for the given segment or all segments, in order of segment then attempt."""
+		query = 'SELECT segment, attempt, time FROM segment_times WHERE gold'
+		if segment is None:
+			return self.database.connection.execute(query + ' ORDER BY segment, attempt').fetchall()
+		return self.database.connection.execute(query + ' AND segment = ? ORDER BY attempt', (segment,)).fetchall()
+
+	def attempts_reaching(self, segment):
+		"""Return how many attempts got as far as the given segment (counting from 0),
+		ie. completed or skipped every segment before it"""
+		(count,), = self.database.connection.execute('SELECT count(*) FROM attempts WHERE reached >= ?', (segment,))
+		return count
@@ -0,0 +1,137 @@
+
+import os
+import errno
+import fcntl
+import struct
+
+from termsplit.timing import SECOND, monotonic_ns
+from termsplit.watch import IN_ATTRIB, IN_CREATE, IN_DELETE, Inotify
+
+
+EVENT = struct.Struct('llHHi') # struct input_event: timeval (sec, usec), type, code, value
+EV_KEY = 1
+KEY_DOWN = 1
+
+EVIOCSCLOCKID = 0x400445a0 # _IOW('E', 0xa0, int), sets the clock used to timestamp events
+CLOCK_MONOTONIC = 1
+
+DEVICE_DIR = '/dev/input'
+SYSFS_DIR = '/sys/class/input'
+
+# errors that indicate a device has gone away
+GONE_ERRNOS = (errno.ENODEV, errno.EIO, errno.EBADF)
+
+
+def has_keys(name):
+	"""Returns whether the named device (eg. 'event3') reports key events, according to sysfs"""
+	try:
+		with open(os.path.join(SYSFS_DIR, name, 'device/capabilities/key')) as f:
+			return any(int(word, 16) for word in f.read().split())
+	except (EnvironmentError, ValueError):
+		return False
+
+
+def key_devices():
+	"""List the names of all event devices that report key events"""
+	try:
+		names = os.listdir(DEVICE_DIR)
+	except OSError:
+		return []
+	return [name for name in names if name.startswith('event') and has_keys(name)]
+
+
+class EventDevice(object):
+	"""An open evdev device node. It is non-blocking, so read it with read_available() whenever it is readable.
+	Events are timestamped by the kernel as they happen, using the same clock as monotonic_ns(),
+	so their timestamps don't depend on how soon we get around to reading them.
+	On kernels that can't do this, events are timestamped when read."""
+
+	def __init__(self, name):
+		self.name = name
+		self.fd = os.open(os.path.join(DEVICE_DIR, name), os.O_RDONLY | os.O_NONBLOCK)
+		try:
+			fcntl.ioctl(self.fd, EVIOCSCLOCKID, struct.pack('i', CLOCK_MONOTONIC))
+			self.kernel_timestamps = True
+		except IOError:
+			self.kernel_timestamps = False
+
+	def fileno(self):
+		return self.fd
+
+	def read_available(self):
+		"""Return a list of events (timestamp, type, code, value) which can be read without blocking, possibly empty"""
+		try:
+			data = os.read(self.fd, EVENT.size * 64)
+		except OSError as ex:
+			if ex.errno != errno.EAGAIN:
+				raise
+			return []
+		if not data:
+			raise OSError(errno.ENODEV, 'Device {} closed'.format(self.name))
+		now = None if self.kernel_timestamps else monotonic_ns()
+		events = []
+		for offset in range(0, len(data) - EVENT.size + 1, EVENT.size):
+			sec, usec, type, code, value = EVENT.unpack_from(data, offset)
+			events.append((sec * SECOND + usec * 1000 if now is None else now, type, code, value))
+		return events
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+
+class KeyDevices(object):
+	"""The open devices that report key events, kept up to date as devices are plugged in and removed.
+	on_add(device) is called as each device is opened, and on_remove(device) just before it is closed.
+	Call update() whenever inotify is readable. inotify is None if hotplug isn't supported,
+	in which case we carry on with the devices present to begin with."""
+
+	def __init__(self, on_add=None, on_remove=None):
+		self.on_add = on_add
+		self.on_remove = on_remove
+		self.devices = {} # {name: EventDevice}
+		# watch for devices being added, removed, or having their permissions set by udev after being added
+		try:
+			self.inotify = Inotify(DEVICE_DIR, IN_CREATE | IN_ATTRIB | IN_DELETE)
+		except EnvironmentError:
+			self.inotify = None
+		for name in key_devices():
+			self.add(name)
+
+	def add(self, name):
+		if name in self.devices or not has_keys(name):
+			return
+		try:
+			device = EventDevice(name)
+		except EnvironmentError:
+			return # not readable, possibly not yet - we'll try again on the next change
+		self.devices[name] = device
+		if self.on_add:
+			self.on_add(device)
+
+	def remove(self, name):
+		"""Close the named device, eg. because it has been unplugged. If it comes back, update() will add it again."""
+		device = self.devices.pop(name, None)
+		if device is None:
+			return
+		if self.on_remove:
+			self.on_remove(device)
+		device.close()
+
+	def update(self):
+		"""Add and remove devices according to pending inotify events, without blocking"""
+		for mask, name in self.inotify.read():
+			if not name.startswith('event'):
+				continue
+			if mask & IN_DELETE:
+				self.remove(name)
+			else:
+				self.add(name)
+
+	def close(self):
+		for name in list(self.devices):
+			self.remove(name)
+		if self.inotify:
+			self.inotify.close()
+			self.inotify = None
@@ -0,0 +1,74 @@
+
+import errno
+from collections import deque
+
+from termsplit.timing import parse_time, format_time
+from termsplit.sketch import QuantileSketch
+
+
+def usable_segments(segments):
+	"""Given the segment times of an attempt (None for skipped segments), return them with the times that
+	can't be used as a time for that segment alone also made None. A segment following a skip
+	was timed together with the skipped one, so its time covers both."""
+	usable = []
+	previous = 0
+	for segment in segments:
+		usable.append(None if previous is None else segment)
+		previous = segment
+	return usable
+
+
+class History(object):
+	"""Append-only record of the segment times of every attempt, kept alongside the splitfile.
+	Attempts are streamed from disk when needed rather than held in memory.
+
+	The format is one attempt per line, consisting of tab-seperated segment times in the same format
+	as the splitfile. Skipped segments are empty, and incomplete attempts simply have fewer times.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def __iter__(self):
+		"""Yield each attempt as a list of segment times (None for skipped segments)"""
+		try:
+			f = open(self.path)
+		except IOError as ex:
+			if ex.errno == errno.ENOENT:
+				return
+			raise
+		with f:
+			for line in f:
+				line = line.rstrip('\n')
+				if not line:
+					continue
+				try:
+					yield [parse_time(value) for value in line.split('\t')]
+				except ValueError:
+					continue # ignore corrupt lines rather than losing all history
+
+	def sketches(self, num_segments):
+		"""Summarize the first num_segments segments of every attempt as a QuantileSketch each
+		(or None for segments with no times), in constant memory"""
+		sketches = [QuantileSketch() for _ in range(num_segments)]
+		for attempt in self:
+			for index, segment in enumerate(usable_segments(attempt[:num_segments])):
+				if segment is not None:
+					sketches[index] = sketches[index].with_value(segment)
+		return [sketch or None for sketch in sketches]
+
+	def attempt(self, number):
+		"""Return the segment times of the given attempt, counting from 1, or from -1 for the most recent.
+		Returns None if there is no such attempt."""
+		if number > 0:
+			for index, attempt in enumerate(self, 1):
+				if index == number:
+					return attempt
+			return None
+		recent = deque(self, maxlen=-number)
+		return recent[0] if len(recent) == -number else None
+
+	def append(self, segments):
+		"""Record an attempt, given its segment times"""
+		with open(self.path, 'a') as f:
+			f.write('\t'.join(format_time(segment) for segment in segments) + '\n')
@@ -0,0 +1,138 @@
+
+import os
+import time
+import errno
+
+import gevent
+import gevent.event
+
+from termsplit.timing import SECOND, monotonic_ns
+
+
+def boot_id():
+	"""Returns an id unique to this boot of the machine, or '' if unknown"""
+	try:
+		with open('/proc/sys/kernel/random/boot_id') as f:
+			return f.read().strip()
+	except EnvironmentError:
+		return ''
+
+
+def wall_ns():
+	return int(time.time() * SECOND)
+
+
+def parse_timestamp(value):
+	"""Parse an integer nanosecond timestamp, or float seconds as written by older versions"""
+	if '.' in value:
+		return int(float(value) * SECOND)
+	return int(value)
+
+
+def _sync(fd):
+	"""fsync and close fd. The journal gives us a dup of its fd, so that it can be closed while
+	we're still running in the threadpool without the fd being closed (or even re-used) from under us."""
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+class Journal(object):
+	"""Append-only log of the timer events of the run in progress, so that the run can be recovered
+	if we crash or are killed. Events are written as soon as the recording greenlet yields,
+	and fsync()ed from the threadpool so that disk latency never blocks timing or input.
+	Writes that arrive while an fsync is in progress are batched into the next one.
+
+	The format is one event per line, tab-seperated:
+		{event}\t{timestamp}
+	preceeded by a line identifying the clock the timestamps were taken from:
+		clock\t{boot id}\t{wall time}\t{monotonic time}
+	so that timestamps can be translated if the machine has rebooted since.
+	All timestamps are integer nanoseconds.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._fd = None
+		self._pending = []
+		self._wakeup = gevent.event.Event()
+		self._flusher = None
+
+	def begin(self, events=()):
+		"""Start a new journal, replacing any existing one. Optionally pre-populate it with events."""
+		self.close()
+		self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+		self._pending.append('clock\t{}\t{}\t{}\n'.format(boot_id(), wall_ns(), monotonic_ns()))
+		for event, timestamp in events:
+			self.record(event, timestamp)
+		self._wakeup.set()
+		self._flusher = gevent.spawn(self._flush_loop)
+
+	def record(self, event, timestamp):
+		"""Record an event, eg. as a Timer listener. Does not block."""
+		if self._fd is None:
+			return
+		self._pending.append('{}\t{}\n'.format(event, timestamp))
+		self._wakeup.set()
+
+	def _flush_loop(self):
+		while True:
+			self._wakeup.wait()
+			self._wakeup.clear()
+			data, self._pending = ''.join(self._pending), []
+			while data:
+				data = data[os.write(self._fd, data):]
+			gevent.get_hub().threadpool.apply(_sync, (os.dup(self._fd),))
+
+	def close(self):
+		"""Stop journalling, leaving the journal on disk. Anything not yet written is written and synced
+		before returning, blocking if need be."""
+		if self._flusher:
+			self._flusher.kill()
+			self._flusher = None
+		if self._fd is not None:
+			data, self._pending = ''.join(self._pending), []
+			if data:
+				while data:
+					data = data[os.write(self._fd, data):]
+				os.fsync(self._fd)
+			os.close(self._fd)
+			self._fd = None
+		self._pending = []
+
+	def discard(self):
+		"""Stop journalling and remove the journal"""
+		self.close()
+		try:
+			os.remove(self.path)
+		except OSError as ex:
+			if ex.errno != errno.ENOENT:
+				raise
+
+	def read(self):
+		"""Read the events of an existing journal as a list of (event, timestamp),
+		with timestamps translated to the current monotonic_ns() clock. Returns None if there is no journal."""
+		try:
+			with open(self.path) as f:
+				lines = f.read().split('\n')
+		except IOError as ex:
+			if ex.errno == errno.ENOENT:
+				return None
+			raise
+		events = []
+		offset = 0
+		for line in lines:
+			parts = line.split('\t')
+			try:
+				if parts[0] == 'clock':
+					_, boot, wall, mono = parts
+					if boot != boot_id():
+						# monotonic clock has been reset by a reboot, translate via wall clock
+						offset = (monotonic_ns() - wall_ns()) - (parse_timestamp(mono) - parse_timestamp(wall))
+					continue
+				event, timestamp = parts
+				events.append((event, parse_timestamp(timestamp) + offset))
+			except ValueError:
+				continue # blank or partially-written line
+		return events
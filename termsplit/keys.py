@@ -1,15 +1,14 @@
 
 from collections import OrderedDict
 
+import gevent.event
 import gevent.queue
 import gevent.pool
-import gevent.monkey
-
-from inputdev import InputDevice
 
 from termsplit.keycodes import KEYCODES
-
-gevent.monkey.patch_all()
+from termsplit.evdev import EV_KEY, GONE_ERRNOS, KEY_DOWN, KeyDevices
+from termsplit.readers import add_reader
+from termsplit.capture import CaptureProcess
 
 
 KEYPRESS_EVENTS = OrderedDict([
@@ -18,30 +17,67 @@ KEYPRESS_EVENTS = OrderedDict([
 	('SKIP', 'Skip a split without recording the time - useful if you forgot to split on time'),
 	('PAUSE', 'Pause the timer, or resume a paused timer'),
 	('STOP', 'Stop timing, saving any best times acquired in that run'),
+	('COMPARE', 'Switch to the next comparison (eg. from PB to sum of best)'),
 ])
 
 
 class KeyPresses(object):
 	"""Generator that yields key codes for key down events recieved from all input devices.
-	Captures all presses starting from when the constructor returns."""
+	Captures all presses starting from when the constructor returns.
+	Devices that are plugged in later are picked up automatically, and devices that are unplugged
+	are dropped without error.
+	Devices are read directly from the event loop as they become readable (see add_reader()),
+	rather than by a greenlet per device.
+	If capture is set, devices are instead read by a seperate process (see CaptureProcess),
+	optionally with raised priority, so that presses keep flowing even if this process stalls.
+	Either way, next_timed() gives the time each key was pressed, not when it was processed."""
 
-	def __init__(self):
-		self.event_queue = gevent.queue.Queue() # contains AsyncResults containing key codes or exceptions
+	def __init__(self, capture=False, priority=False):
+		self.event_queue = gevent.queue.Queue() # contains AsyncResults containing (key, timestamp) or exceptions
 		self.group = gevent.pool.Group()
-		for device in InputDevice.find(key=lambda value: value is not None):
-			self.group.spawn(self.reader, device)
+		self.watchers = {} # {device name: watcher}
+		self.devices = None
+		self.capture = None
+		if capture:
+			self.capture = CaptureProcess(priority)
+			self.capture_watcher = add_reader(self.capture.fd, self.read_capture)
+			return
+		self.devices = KeyDevices(on_add=self.watch_device, on_remove=self.unwatch_device)
+		if self.devices.inotify:
+			self.group.spawn(self.monitor)
+
+	def watch_device(self, device):
+		self.watchers[device.name] = add_reader(device.fd, self.read_device, device)
+
+	def unwatch_device(self, device):
+		self.watchers.pop(device.name).stop()
+
+	def monitor(self):
+		while True:
+			self.devices.inotify.wait()
+			self.devices.update()
 
-	def reader(self, device):
+	def read_device(self, device):
+		"""Called from the event loop when device is readable"""
 		try:
-			for event in device.read_iter():
-				if event.type != 'key' or event.value != 1 or event.code not in KEYCODES:
+			for timestamp, type, code, value in device.read_available():
+				if type != EV_KEY or value != KEY_DOWN or code not in KEYCODES:
 					continue
-				self.enqueue(KEYCODES[event.code])
+				self.enqueue((KEYCODES[code], timestamp))
 		except Exception as ex:
+			self.devices.remove(device.name)
+			# if the device was unplugged, monitor will add it again if it comes back
+			if not (isinstance(ex, EnvironmentError) and ex.errno in GONE_ERRNOS):
+				self.enqueue(ex, exception=True)
+
+	def read_capture(self):
+		"""Called from the event loop when the capture process's pipe is readable"""
+		try:
+			for press in self.capture.read_available():
+				self.enqueue(press)
+		except Exception as ex:
+			self.capture_watcher.stop()
 			self.enqueue(ex, exception=True)
-			raise
-		finally:
-			device.close()
 
 	def enqueue(self, value, exception=False):
 		result = gevent.event.AsyncResult()
@@ -50,9 +86,19 @@ class KeyPresses(object):
 
 	def close(self):
 		self.group.kill(block=True)
+		if self.devices:
+			self.devices.close()
+		if self.capture:
+			self.capture_watcher.stop()
+			self.capture.close()
 
 	def __iter__(self):
 		return self
 
 	def next(self):
+		key, timestamp = self.next_timed()
+		return key
+
+	def next_timed(self):
+		"""Return the next (key, timestamp), where timestamp is the monotonic_ns() time of the press"""
 		return self.event_queue.get().get() # will error if exception occurred in worker
@@ -1,12 +1,27 @@
 
-import json
 import os
+import time
 
-from argh import EntryPoint, arg, confirm, named
+from argh import CommandError, EntryPoint, arg, confirm, named
 
 from termsplit.keys import KEYPRESS_EVENTS, KeyPresses
 from termsplit.ui import UI
 from termsplit.splits import Splits
+from termsplit.convert import process_file, process_map
+from termsplit.config import DEFAULT_PATH, Config
+from termsplit.database import Database, DatabaseHistory, is_database
+from termsplit.timing import SECOND, format_time
+from termsplit.bench import input_latency, percentile
+
+
+def load_config(conf):
+	"""Load the given (or default) config file, raising CommandError if it is missing or invalid"""
+	try:
+		return Config.load(conf)
+	except EnvironmentError as ex:
+		raise CommandError('Cannot read config file: {}. Run termsplit configure to create one.'.format(ex))
+	except ValueError as ex:
+		raise CommandError('Invalid config file: {}'.format(ex))
 
 
 cli = EntryPoint()
@@ -17,42 +32,127 @@ cli = EntryPoint()
 def configure(conf=None):
 	"""Interactive configuration setup. Conf file will be created if it doesn't exist."""
 	if not conf:
-		conf = os.path.expanduser('~/.termsplit.json')
-	if os.path.exists(conf):
-		with open(conf) as f:
-			config = json.loads(f.read())
-	else:
-		config = {}
+		conf = DEFAULT_PATH
+	config = load_config(conf) if os.path.exists(conf) else Config()
 
 	for event, description in KEYPRESS_EVENTS.items():
 		print '{}: {}'.format(event, description)
-		if event in config and confirm('Current value: {}. Keep this value'.format(config[event]), True):
+		if event in config.bindings and confirm('Current value: {}. Keep this value'.format(config.bindings[event]), True):
 			print
 			continue
 		raw_input("Press Enter when ready.")
 		iterator = KeyPresses() # we only capture presses after this line
 		print "Now press the button to bind."
 		key_name = iterator.next()
-		config[event] = key_name
+		config.bind(event, key_name)
 		print "Bound {} to {}".format(event, key_name)
 		print
 
-	dump = json.dumps(config, indent=4)
 	print "Final config:"
-	print dump
-
-	with open(conf, 'w') as f:
-		f.write(dump + '\n')
+	print config.dump()
+	config.save(conf)
 
 
 @cli
 @arg('--conf', help='Config file to use, default ~/.termsplit.json')
+@arg('--nonblocking-output', help='Never let a slow terminal hold up input or timing, at the cost of dropping frames')
+@arg('--profile', help='Start with profiling enabled. Press p to show results.')
+@arg('--capture-input', help='Read hotkeys in a seperate process, so they keep flowing even if the display stalls')
+@arg('--input-priority', help='With --capture-input, try to run the input process at realtime or raised priority')
 @named('open')
-def open_splits(splitfile, conf=None):
+def open_splits(splitfile, conf=None, nonblocking_output=False, profile=False, capture_input=False, input_priority=False):
 	"""Open the given splits file and bring up the main timer interface."""
-	if not conf:
-		conf = os.path.expanduser('~/.termsplit.json')
-	with open(conf) as f:
-		config = json.loads(f.read())
+	config = load_config(conf)
+	splits = Splits(splitfile)
+	UI(
+		config, splits, splitfile,
+		nonblocking_output=nonblocking_output, profile=profile,
+		capture_input=capture_input, input_priority=input_priority,
+	).main()
+
+
+def _report(results):
+	"""Print each result from process_file as it arrives, then a summary. Raises CommandError on any errors."""
+	counts = {'files': 0, 'segments': 0, 'changed': 0, 'errors': 0, 'warnings': 0}
+	for result in results:
+		counts['files'] += 1
+		counts['segments'] += result['segments']
+		if result['error']:
+			counts['errors'] += 1
+			print 'ERROR {}: {}'.format(result['path'], result['error'])
+			continue
+		counts['changed'] += result['changed']
+		counts['warnings'] += len(result['warnings'])
+		status = 'CHANGED' if result['changed'] else 'OK'
+		if result['output'] and result['output'] != result['path']:
+			status = '{} -> {}'.format(status, result['output'])
+		print '{} {} ({} segments)'.format(status, result['path'], result['segments'])
+		for warning in result['warnings']:
+			print '\twarning: {}'.format(warning)
+	print
+	print '{files} files, {segments} segments: {changed} not normalized, {warnings} warnings, {errors} errors'.format(**counts)
+	if counts['errors']:
+		raise CommandError('{} files could not be processed'.format(counts['errors']))
+
+
+@cli
+@arg('splitfiles', nargs='+', help='Splitfiles to convert')
+@arg('--output-dir', help='Write converted files here instead of re-writing them in place')
+@arg('--jobs', type=int, help='Number of worker processes, default one per CPU')
+def convert(splitfiles, output_dir=None, jobs=None):
+	"""Parse and re-write many splitfiles in parallel, normalizing all times to the standard format."""
+	if output_dir:
+		names = [os.path.basename(path) for path in splitfiles]
+		if len(set(names)) != len(names):
+			raise CommandError('Splitfiles must have unique names to be written to the same output dir')
+		outputs = [os.path.join(output_dir, name) for name in names]
+	else:
+		outputs = splitfiles
+	_report(process_map(process_file, zip(splitfiles, outputs), jobs))
+
+
+@cli
+@arg('splitfiles', nargs='+', help='Splitfiles to validate')
+@arg('--jobs', type=int, help='Number of worker processes, default one per CPU')
+def validate(splitfiles, jobs=None):
+	"""Check many splitfiles in parallel for parse errors and inconsistencies, without changing them."""
+	_report(process_map(process_file, ((path,) for path in splitfiles), jobs))
+
+
+@cli
+@arg('--best', type=int, help='Show the fastest N completed attempts')
+@arg('--golds', help='Show every new best segment time, and the attempt it was set in')
+@arg('--reaching', type=int, help='Show how many attempts got as far as this segment (counting from 1)')
+def history(splitfile, best=None, golds=False, reaching=None):
+	"""Query the history of attempts kept in a splits database (a splitfile ending in .db, .sqlite or .sqlite3)."""
+	if not is_database(splitfile) or not os.path.exists(splitfile):
+		raise CommandError('{} is not a splits database'.format(splitfile))
 	splits = Splits(splitfile)
-	UI(config, splits, splitfile).main()
+	attempts = DatabaseHistory(Database(splitfile))
+	if best:
+		print 'Fastest {} attempts:'.format(best)
+		for number, recorded, total in attempts.best_attempts(best):
+			print '#{}\t{}\t{}'.format(number, time.strftime('%Y-%m-%d %H:%M', time.localtime(recorded / SECOND)), format_time(total))
+	if golds:
+		print 'Golds:'
+		for segment, number, segment_time in attempts.golds():
+			name = splits[segment][0] if segment < len(splits) else segment
+			print '{}\t#{}\t{}'.format(name, number, format_time(segment_time))
+	if reaching:
+		print '{} attempts reached segment {}'.format(attempts.attempts_reaching(reaching - 1), reaching)
+
+
+@cli
+@arg('--count', type=int, help='Number of inputs to send')
+@arg('--interval', type=float, help='Time between inputs, in seconds')
+@named('bench-input')
+def bench_input(count=1000, interval=0.001):
+	"""Compare the latency and cpu cost of the ways input can be read from a file descriptor:
+	a greenlet per fd (as input used to be read), or event loop callbacks (as input is now read)."""
+	for backend in ('greenlet', 'callback'):
+		latencies, cpu = input_latency(backend, count, interval)
+		print '{:<10} latency (us): median {:.1f}, 99% {:.1f}, max {:.1f}; cpu per input: {:.1f}us'.format(
+			backend, *[1e6 * value for value in (
+				percentile(latencies, 0.5), percentile(latencies, 0.99), latencies[-1], cpu / count,
+			)]
+		)
@@ -0,0 +1,62 @@
+
+import os
+
+from termsplit.timing import parse_time, format_time
+
+
+# splitfiles with this extension are manifests of a marathon's games, see read_manifest()
+EXTENSION = '.marathon'
+
+
+def is_manifest(filepath):
+	return os.path.splitext(filepath)[1] == EXTENSION
+
+
+class Part(object):
+	"""One game of a marathon: its splitfile, and totals of its splits cached in the manifest,
+	so that it can be summarized without loading it."""
+
+	def __init__(self, name, path, best=None, time=None):
+		self.name = intern(name)
+		self.path = path # as written in the manifest
+		self.filepath = path # path resolved relative to the manifest, see read_manifest()
+		self.best = best # sum of best times, or None if any are unknown
+		self.time = time # time of the best run, or None if unknown
+		self.saved = None # Splits as last loaded from or saved to filepath, or None if not loaded
+
+	def update(self, splits):
+		"""Set the splits as they are on disk, and re-calculate the totals"""
+		self.saved = splits
+		bests = [best for name, best, time in splits]
+		self.best = None if None in bests else sum(bests)
+		_, _, self.time = splits[-1]
+
+
+def read_manifest(filepath):
+	r"""Read a marathon's manifest, returning a list of Part.
+	The manifest consists of a line for each game in order, as follows:
+		{name}\t{path of splitfile}
+	where the path is relative to the manifest. Lines may have two more columns, the game's sum of best times
+	and time of its best run. They are maintained automatically and can be left alone when editing."""
+	directory = os.path.dirname(filepath)
+	parts = []
+	with open(filepath) as f:
+		for line in f:
+			if not line.strip():
+				continue
+			values = line.rstrip('\n').split('\t')
+			if len(values) not in (2, 4):
+				raise ValueError('Bad line in manifest: {!r}'.format(line))
+			name, path = values[:2]
+			part = Part(name, path, *[parse_time(value) for value in values[2:]])
+			part.filepath = os.path.join(directory, path)
+			parts.append(part)
+	if not parts:
+		raise ValueError('Manifest {} has no games'.format(filepath))
+	return parts
+
+
+def write_manifest(filepath, parts):
+	with open(filepath, 'w') as f:
+		for part in parts:
+			f.write('\t'.join([part.name, part.path, format_time(part.best), format_time(part.time)]) + '\n')
@@ -0,0 +1,145 @@
+
+import os
+import stat
+import errno
+import fcntl
+from collections import deque
+
+import gevent
+import gevent.event
+import gevent.socket
+
+
+class FrameBuffer(object):
+	"""Collects everything drawn for a frame so that it reaches the terminal in a single write.
+	Callers write() as they draw, then flush() once the frame is complete.
+	Counts the write syscalls made, so output cost can be measured without strace."""
+
+	def __init__(self, fd=1):
+		self.fd = fd
+		self._parts = []
+		self.writes = 0 # number of write syscalls made
+		self.frames = 0 # number of non-empty flushes
+		self.bytes = 0 # number of bytes written
+
+	def write(self, data):
+		self._parts.append(data)
+
+	def writeline(self, line=''):
+		self._parts.append(line + '\n')
+
+	def take(self):
+		"""Return and clear the contents of the current frame"""
+		data = ''.join(self._parts)
+		self._parts = []
+		return data
+
+	def flush(self, droppable=False, full=False):
+		"""Write out the current frame. droppable indicates the frame only redraws something that the
+		next droppable frame will redraw again, so it may be skipped if output is backed up.
+		full indicates the frame redraws the whole screen, so supersedes everything before it."""
+		data = self.take()
+		if not data:
+			return
+		self.frames += 1
+		while data:
+			written = os.write(self.fd, data)
+			self.writes += 1
+			self.bytes += written
+			data = data[written:]
+
+	def close(self):
+		pass
+
+
+class NonBlockingFrameBuffer(FrameBuffer):
+	"""A FrameBuffer whose flush() never blocks on the terminal.
+	Frames are queued and written by a background greenlet using non-blocking writes,
+	which cooperatively waits whenever the terminal isn't accepting data.
+	If output backs up, droppable frames that have been superseded are discarded, and if the backlog
+	still exceeds MAX_PENDING bytes everything pending is discarded and on_overflow() is called,
+	which should arrange for a full redraw. A full redraw supersedes everything pending,
+	and is always let through however large it is.
+
+	The fd is re-opened, so that making it non-blocking doesn't affect anything else using the terminal
+	(eg. stdin and stderr, which usually share stdout's open file). Sockets can't be re-opened,
+	so in that case the shared open file is made non-blocking."""
+	MAX_PENDING = 64 * 1024
+	CLOSE_TIMEOUT = 1 # how long to wait for pending output to drain on close
+
+	def __init__(self, fd=1, on_overflow=None):
+		super(NonBlockingFrameBuffer, self).__init__(fd)
+		self.on_overflow = on_overflow
+		self.dropped = 0 # number of frames discarded
+		self._queue = deque() # (data, droppable)
+		self._pending_bytes = 0
+		self._ready = gevent.event.Event()
+		self._drained = gevent.event.Event()
+		self._drained.set()
+		self.fd = self._reopen(fd)
+		self._writer = gevent.spawn(self._write_loop)
+
+	@staticmethod
+	def _reopen(fd):
+		"""Return a new non-blocking fd, with its own open file, for writing to the same place as fd"""
+		if stat.S_ISREG(os.fstat(fd).st_mode):
+			return os.dup(fd) # writes to files never block, and re-opening would lose our position
+		path = os.ttyname(fd) if os.isatty(fd) else '/proc/self/fd/{}'.format(fd)
+		try:
+			return os.open(path, os.O_WRONLY | os.O_NONBLOCK | os.O_NOCTTY)
+		except OSError as ex:
+			if ex.errno != errno.ENXIO:
+				raise
+		# sockets can't be re-opened, so we have no choice but to make the shared one non-blocking
+		fd = os.dup(fd)
+		fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+		return fd
+
+	def flush(self, droppable=False, full=False):
+		data = self.take()
+		if not data:
+			return
+		self.frames += 1
+		# a new droppable frame supersedes any droppable frames still waiting directly before it,
+		# and a full frame supersedes all of them
+		while self._queue and (full or droppable and self._queue[-1][1]):
+			old, _ = self._queue.pop()
+			self._pending_bytes -= len(old)
+			self.dropped += 1
+		if not full and self._pending_bytes + len(data) > self.MAX_PENDING:
+			self.dropped += len(self._queue) + 1
+			self._queue.clear()
+			self._pending_bytes = 0
+			if self.on_overflow:
+				self.on_overflow()
+			return
+		self._queue.append((data, droppable))
+		self._pending_bytes += len(data)
+		self._drained.clear()
+		self._ready.set()
+
+	def _write_loop(self):
+		while True:
+			self._ready.wait()
+			while self._queue:
+				data, _ = self._queue.popleft()
+				self._pending_bytes -= len(data)
+				while data:
+					try:
+						written = os.write(self.fd, data)
+					except OSError as ex:
+						if ex.errno != errno.EAGAIN:
+							raise
+						gevent.socket.wait_write(self.fd)
+						continue
+					self.writes += 1
+					self.bytes += written
+					data = data[written:]
+			self._ready.clear()
+			self._drained.set()
+
+	def close(self):
+		"""Give pending output a chance to drain, then stop writing"""
+		self._drained.wait(self.CLOSE_TIMEOUT)
+		self._writer.kill()
+		os.close(self.fd)
@@ -0,0 +1,118 @@
+
+import random
+from bisect import bisect_left
+
+
+class SegmentDistribution(object):
+	"""Approximates the distribution of a segment's time as a fixed number of evenly-spaced quantiles,
+	so it costs the same to use no matter how many attempts it was built from."""
+	QUANTILES = 32
+
+	def __init__(self, sketch):
+		"""Take quantiles from a QuantileSketch (or None, for no history)"""
+		self.quantiles = [
+			sketch.quantile((i + 0.5) / self.QUANTILES)
+			for i in range(self.QUANTILES)
+		] if sketch else []
+
+	def __nonzero__(self):
+		return bool(self.quantiles)
+
+	def sample(self, rng):
+		return rng.choice(self.quantiles)
+
+	def median_above(self, elapsed):
+		"""Median time for this segment, given it has already taken at least elapsed"""
+		index = bisect_left(self.quantiles, elapsed)
+		remaining = self.quantiles[index:]
+		return remaining[len(remaining) / 2] if remaining else elapsed
+
+
+class Predictor(object):
+	"""Estimates the final time of a run in progress, and its chance of being a new best run,
+	from the historical distribution of each segment's time.
+
+	Each segment's time is sampled SAMPLES times, and for each sample we keep the total of the segments
+	after the current one. Moving onto another segment only adds or subtracts the samples of the segments
+	passed over (O(SAMPLES) per split), and the sorted totals are cached. Each frame then only needs
+	an estimate for the current segment and a binary search, so drawing cost stays flat however many
+	segments there are.
+	"""
+	SAMPLES = 1000
+
+	def __init__(self, distributions):
+		self.distributions = distributions
+		self._missing = set(index for index, dist in enumerate(distributions) if not dist)
+		self._all = [0] * self.SAMPLES # for each sample, total time of every segment
+		for index in range(len(distributions)):
+			self._all = self._add(self._all, index, 1)
+		self._index = -1 # the segment _totals are the segments after
+		self._totals = self._all # for each sample, total time of the segments after _index
+		self._rest = False # what _simulate_rest() returns for _index, or False if not yet worked out
+
+	@classmethod
+	def from_splits(cls, splits):
+		"""Build a Predictor from the sketches of a Splits"""
+		return cls([SegmentDistribution(sketch) for sketch in splits.sketches])
+
+	def _samples(self, index):
+		"""The SAMPLES sampled times of a segment. They are the same every time, so that they can be
+		subtracted again, and so the display doesn't jitter between runs."""
+		dist = self.distributions[index]
+		if not dist:
+			return [0] * self.SAMPLES
+		rng = random.Random(index)
+		return [dist.sample(rng) for _ in range(self.SAMPLES)]
+
+	def _add(self, totals, index, sign):
+		"""Return totals with a segment's samples added (sign 1) or subtracted (sign -1)"""
+		return [total + sign * sample for total, sample in zip(totals, self._samples(index))]
+
+	def update(self, index, sketch):
+		"""Update a single segment's distribution, eg. after an attempt has been added to its sketch"""
+		self._all = self._add(self._all, index, -1)
+		if index > self._index:
+			self._totals = self._add(self._totals, index, -1)
+		self.distributions[index] = SegmentDistribution(sketch)
+		if self.distributions[index]:
+			self._missing.discard(index)
+		else:
+			self._missing.add(index)
+		self._all = self._add(self._all, index, 1)
+		if index > self._index:
+			self._totals = self._add(self._totals, index, 1)
+		self._rest = False
+
+	def _simulate_rest(self, index):
+		"""Return the sorted simulated totals of the segments after index, or None if any have no history"""
+		if index == self._index and self._rest is not False:
+			return self._rest
+		if index < self._index - index:
+			# closer to the start than to where we were, eg. after a reset
+			self._index = -1
+			self._totals = self._all
+		while self._index < index:
+			self._index += 1
+			self._totals = self._add(self._totals, self._index, -1)
+		while self._index > index:
+			self._totals = self._add(self._totals, self._index, 1)
+			self._index -= 1
+		if any(missing > index for missing in self._missing):
+			self._rest = None
+		else:
+			self._rest = sorted(self._totals)
+		return self._rest
+
+	def predict(self, index, split_time, segment_time, pb_time=None):
+		"""Given that segment index began at split_time and has taken segment_time so far,
+		return (projected final time, chance of beating pb_time or None if no pb_time),
+		or None if there isn't enough history to say."""
+		if index >= len(self.distributions) or not self.distributions[index]:
+			return None
+		rest = self._simulate_rest(index)
+		if rest is None:
+			return None
+		so_far = split_time + self.distributions[index].median_above(segment_time)
+		projected = so_far + rest[len(rest) / 2]
+		chance = None if pb_time is None else bisect_left(rest, pb_time - so_far) / float(len(rest))
+		return projected, chance
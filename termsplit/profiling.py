@@ -0,0 +1,68 @@
+
+from collections import OrderedDict
+from functools import wraps
+
+from monotonic import monotonic
+
+
+class Profiler(object):
+	"""Counts calls to, and time spent in, a set of functions.
+	Functions are instrumented by replacing them on the object (instance, class or module) they're
+	looked up on, and restored when disabled, so there is no cost at all while profiling is off."""
+
+	def __init__(self, targets):
+		"""targets is a list of (object, attribute name) of functions to instrument"""
+		self.targets = targets
+		self.enabled = False
+		self.enabled_at = None
+		self.counters = OrderedDict() # {name: [calls, total time, max time]}
+		self._originals = [] # (obj, name, value in obj.__dict__ or None)
+
+	def enable(self):
+		"""Start profiling, with fresh counters"""
+		if self.enabled:
+			return
+		self.counters = OrderedDict((name, [0, 0, 0]) for obj, name in self.targets)
+		for obj, name in self.targets:
+			self._originals.append((obj, name, vars(obj).get(name)))
+			setattr(obj, name, self._wrap(getattr(obj, name), self.counters[name]))
+		self.enabled = True
+		self.enabled_at = monotonic()
+
+	def disable(self):
+		"""Stop profiling, leaving counters intact"""
+		for obj, name, original in self._originals:
+			if original is None:
+				delattr(obj, name)
+			else:
+				setattr(obj, name, original)
+		self._originals = []
+		self.enabled = False
+
+	@staticmethod
+	def _wrap(fn, counter):
+		@wraps(fn)
+		def _profiled(*args, **kwargs):
+			start = monotonic()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				elapsed = monotonic() - start
+				counter[0] += 1
+				counter[1] += elapsed
+				counter[2] = max(counter[2], elapsed)
+		return _profiled
+
+	def report(self):
+		"""Return a list of lines describing the counters"""
+		duration = monotonic() - self.enabled_at if self.enabled_at else 0
+		lines = ['Profile over {:.1f}s:'.format(duration)]
+		width = max([len(name) for name in self.counters] + [4])
+		lines.append('\t{:<{width}}  {:>8}  {:>10}  {:>8}  {:>8}'.format(
+			'Name', 'Calls', 'Total ms', 'Avg us', 'Max us', width=width,
+		))
+		for name, (calls, total, longest) in self.counters.items():
+			lines.append('\t{:<{width}}  {:>8}  {:>10.1f}  {:>8.1f}  {:>8.1f}'.format(
+				name, calls, total * 1e3, total * 1e6 / calls if calls else 0, longest * 1e6, width=width,
+			))
+		return lines
@@ -0,0 +1,17 @@
+
+import gevent
+
+
+READ = 1 # libev/libuv event mask for readability
+
+
+def add_reader(fd, callback, *args):
+	"""Call callback(*args) directly from the event loop whenever fd is readable,
+	in the manner of asyncio's loop.add_reader(). Unlike a greenlet looping on select() or wait_read(),
+	this costs no greenlet switches or watcher setup per event.
+	The callback runs in the hub, so it must not block or switch (eg. it may put to an unbounded queue,
+	but not get from one), and should handle its own exceptions.
+	Returns the watcher, call its stop() method to stop watching."""
+	watcher = gevent.get_hub().loop.io(fd, READ)
+	watcher.start(callback, *args)
+	return watcher
@@ -0,0 +1,98 @@
+
+from bisect import bisect_left
+
+from termsplit.timing import parse_time, format_time
+
+
+class QuantileSketch(object):
+	"""A fixed-size, mergeable summary of a stream of times, for estimating quantiles (median etc.)
+	without keeping every value. In the style of a t-digest, values are kept as at most MAX_CENTROIDS
+	(mean, count) centroids in sorted order. When there are too many, the adjacent pair with the smallest
+	combined count is merged, so centroids end up holding roughly equal shares of the values.
+
+	Sketches are immutable: with_value() and merged() return new sketches. This means they can be shared
+	between copies of Splits the same way rows are.
+
+	The text format (used as the fourth column of the splitfile) is a comma-seperated list of
+	{mean}*{count}, with means in the same format as other times, eg. 00:31.250*3,00:32.000*1
+	"""
+	MAX_CENTROIDS = 32
+
+	def __init__(self, centroids=()):
+		"""centroids is a sorted list of (mean, count)"""
+		self.centroids = tuple(centroids)
+		self.count = sum(count for mean, count in self.centroids)
+
+	def __nonzero__(self):
+		return self.count > 0
+
+	def __eq__(self, other):
+		return isinstance(other, QuantileSketch) and self.centroids == other.centroids
+
+	def __ne__(self, other):
+		return not self == other
+
+	def with_value(self, value):
+		"""Return a new sketch which also includes value"""
+		centroids = list(self.centroids)
+		index = bisect_left(centroids, (value, 0))
+		centroids.insert(index, (value, 1))
+		return QuantileSketch(self._compress(centroids))
+
+	def merged(self, other):
+		"""Return a new sketch summarizing the values of both sketches"""
+		return QuantileSketch(self._compress(sorted(self.centroids + other.centroids)))
+
+	@classmethod
+	def _compress(cls, centroids):
+		while len(centroids) > cls.MAX_CENTROIDS:
+			index = min(range(len(centroids) - 1), key=lambda i: centroids[i][1] + centroids[i + 1][1])
+			(mean_a, count_a), (mean_b, count_b) = centroids[index:index + 2]
+			count = count_a + count_b
+			centroids[index:index + 2] = [((mean_a * count_a + mean_b * count_b) / count, count)]
+		return centroids
+
+	def mean(self):
+		if not self:
+			return None
+		return sum(mean * count for mean, count in self.centroids) / self.count
+
+	def quantile(self, q):
+		"""Estimate the value below which fraction q of values fall, interpolating between centroids,
+		each of which is treated as being centered on its share of the cumulative count."""
+		if not self:
+			return None
+		target = q * self.count
+		cumulative = 0
+		previous_mean, previous_center = None, None
+		for mean, count in self.centroids:
+			center = cumulative + count / 2.
+			if target <= center:
+				if previous_mean is None:
+					return mean
+				fraction = (target - previous_center) / (center - previous_center)
+				return int(round(previous_mean + (mean - previous_mean) * fraction))
+			previous_mean, previous_center = mean, center
+			cumulative += count
+		return previous_mean
+
+	def median(self):
+		return self.quantile(0.5)
+
+	def serialize(self):
+		return ','.join('{}*{}'.format(format_time(mean), count) for mean, count in self.centroids)
+
+	@classmethod
+	def parse(cls, data):
+		"""Parse the output of serialize(). Returns None for empty string."""
+		data = data.strip()
+		if not data:
+			return None
+		centroids = []
+		try:
+			for part in data.split(','):
+				mean, count = part.split('*')
+				centroids.append((parse_time(mean), int(count)))
+		except ValueError as ex:
+			raise ValueError("Cannot parse sketch {!r}: {}".format(data, ex))
+		return cls(sorted(centroids))
@@ -1,6 +1,10 @@
 
 
 from termsplit.timing import parse_time, format_time
+from termsplit.sketch import QuantileSketch
+from termsplit.history import usable_segments
+from termsplit.database import Database, is_database
+from termsplit.marathon import is_manifest, read_manifest, write_manifest
 
 
 class Splits(object):
@@ -11,6 +15,8 @@ class Splits(object):
 		{name}\t{best time}\t{time of split in best run}\n
 	Note that best time is elapsed since start of split,
 	whereas time of split in best run is elapsed since the start of the run.
+	Lines may have an optional fourth column summarizing the segment's times over all attempts
+	(see QuantileSketch). It is maintained automatically and can be left alone when editing.
 
 	For example, suppose I was timing a racing game with a 3-lap structure. Suppose my lap times were
 	31s, 30s and 32s, and this was my first run (so they are both my best split times and my best overall).
@@ -19,6 +25,22 @@ class Splits(object):
 		Second Lap	00:30.00	01:01.00
 		Third Lap	00:32.00	01:33.00
 
+	Splits may be grouped, by giving a line with just the group's name, followed by its splits (or further groups)
+	indented more deeply than it. Times are only given for splits, and a group's times are derived from them.
+	For example:
+		World 1
+		  1-1	00:31.000	00:31.000
+		  1-2	00:40.000	01:11.000
+		World 2
+		  2-1	00:35.000	01:46.000
+
+	Splitfiles with a database extension (see termsplit.database) are instead stored in a sqlite database,
+	along with their history of attempts.
+
+	A marathon's splitfile is a manifest of the splitfiles of its games (see termsplit.marathon).
+	Each game is a group, and is only loaded once the run reaches it (see expand()).
+	Until then it is a single row, whose times are taken from the manifest.
+
 	A note on time formats:
 		The following time formats are accepted:
 			seconds alone, eg. 3661.05
@@ -26,11 +48,18 @@ class Splits(object):
 			H:M:S, eg. 1:01:01.05 or 1:1:1.05
 		The program will produce time in the format [H:]MM:SS.sss, eg. 1:01:01.050
 	"""
-	splits = None # list of (name, best time, time in best run)
+	splits = None # list of (name, best time, time in best run). Rows are immutable and may be shared between Splits.
+	sketches = None # list of QuantileSketch or None, summarizing each segment's time over all attempts
+	groups = None # list of (name, start, end, depth) for each group of splits[start:end], outermost first
+	version = 0 # incremented on every modification, so derived values can be cached
+	INDENT = '  ' # written before the lines of grouped splits, per level of grouping
+	parts = None # for a marathon, [Part, Splits of that game or None if not loaded] for each game, in order
 
 	def __init__(self, filepath=None):
 		"""Optionally load from path"""
 		self.splits = []
+		self.sketches = []
+		self._set_groups([])
 		if filepath:
 			self.loadfile(filepath)
 
@@ -41,17 +70,84 @@ class Splits(object):
 	def __getitem__(self, item):
 		return self.splits[item]
 
+	def __setitem__(self, item, row):
+		_, old_best, _ = self.splits[item]
+		self.splits[item] = row
+		_, best, _ = row
+		# keep the sums of best times of the groups this split is in up to date, in O(depth)
+		for group in self._ancestors[item]:
+			total, unknown = self._group_bests[group]
+			if old_best is None:
+				unknown -= 1
+			else:
+				total -= old_best
+			if best is None:
+				unknown += 1
+			else:
+				total += best
+			self._group_bests[group] = total, unknown
+		self.version += 1
+
 	def __eq__(self, other):
-		return isinstance(other, Splits) and other.splits == self.splits
+		return (
+			isinstance(other, Splits) and other.splits == self.splits
+			and other.sketches == self.sketches and other.groups == self.groups
+		)
+
+	def __ne__(self, other):
+		return not self == other
 
 	def __len__(self):
 		return len(self.splits)
 
 	def copy(self):
+		"""Rows are immutable, so the copy shares them with the original"""
 		ret = Splits()
-		ret.load(self.dump())
+		ret.splits = list(self.splits)
+		ret.sketches = list(self.sketches)
+		ret.groups = self.groups
+		ret._ancestors = list(self._ancestors)
+		ret._groups_at = self._groups_at
+		ret._group_bests = list(self._group_bests)
+		if self.parts:
+			ret.parts = [[part, splits and splits.copy()] for part, splits in self.parts]
 		return ret
 
+	def _set_groups(self, groups):
+		"""Replace the groups, and re-calculate everything derived from them"""
+		self.groups = groups
+		self._ancestors = [()] * len(self.splits) # for each split, the indexes of the groups it is in
+		self._groups_at = {} # {start: indexes of groups starting there, outermost first}
+		self._group_bests = [] # for each group, (sum of known best times, number of unknown best times)
+		for index, (name, start, end, depth) in enumerate(groups):
+			self._groups_at.setdefault(start, []).append(index)
+			for split in range(start, end):
+				self._ancestors[split] += (index,)
+			bests = [best for name, best, time in self.splits[start:end]]
+			self._group_bests.append((sum(best for best in bests if best is not None), bests.count(None)))
+
+	def depth(self, index):
+		"""Number of groups the given split is in"""
+		return len(self._ancestors[index])
+
+	def groups_at(self, index):
+		"""Return indexes of the groups starting at the given split, outermost first"""
+		return self._groups_at.get(index, [])
+
+	def group_best(self, group):
+		"""Sum of best times of the group's splits, or None if any are unknown"""
+		total, unknown = self._group_bests[group]
+		return None if unknown else total
+
+	def group_best_run_segment_time(self, group):
+		"""Time taken by the group in the best run"""
+		name, start, end, depth = self.groups[group]
+		_, _, end_time = self[end - 1]
+		start_time = self[start - 1][2] if start else 0
+		if start_time is None or end_time is None:
+			return None
+		return end_time - start_time
+
 	def best_run_segment_time(self, index):
 		"""Get the segment time for the given segment index of the best run"""
 		_, _, end_time = self[index]
@@ -63,48 +159,290 @@ class Splits(object):
 			return None
 		return end_time - start_time
 
-	def load(self, data):
-		for line in data.split('\n'):
+	@staticmethod
+	def split_lines(data):
+		"""Return the non-blank lines of data, each of which describes one split or group.
+		Lines keep their indentation."""
+		return [line.rstrip() for line in data.split('\n') if line.strip()]
+
+	@staticmethod
+	def outline(lines):
+		"""Work out the structure of the given lines (from split_lines()) from their indentation.
+		Returns (structure, split lines), where structure is a list of (indent, group name or None for splits)
+		for each line, and split lines are the stripped lines which describe splits."""
+		structure = []
+		split_lines = []
+		indents = [len(line.expandtabs()) - len(line.expandtabs().lstrip()) for line in lines]
+		for index, (line, indent) in enumerate(zip(lines, indents)):
 			line = line.strip()
-			if not line:
-				continue
-			parts = line.split('\t')
-			parts = parts[:3] # ignore columns past the third
-			parts += [''] * (3 - len(parts)) # pad with '' to 3 members
-			name, best, time = parts
-			best = parse_time(best)
-			time = parse_time(time)
-			self.splits.append((name, best, time))
+			if index + 1 < len(lines) and indents[index + 1] > indent:
+				name, _, rest = line.partition('\t')
+				if rest.strip():
+					raise ValueError('Group {!r} cannot have times, they are calculated from its splits'.format(name))
+				structure.append((indent, intern(name)))
+			else:
+				structure.append((indent, None))
+				split_lines.append(line)
+		return structure, split_lines
+
+	@staticmethod
+	def parse_line(line):
+		"""Parse a single (stripped, non-blank) line into a row (name, best time, time in best run)"""
+		parts = line.split('\t')
+		parts = parts[:3] # ignore columns past the third
+		parts += [''] * (3 - len(parts)) # pad with '' to 3 members
+		name, best, time = parts
+		return intern(name), parse_time(best), parse_time(time)
+
+	@staticmethod
+	def parse_sketch(line):
+		"""Parse the optional fourth column of a line, returning a QuantileSketch or None"""
+		parts = line.split('\t')
+		return QuantileSketch.parse(parts[3]) if len(parts) > 3 else None
+
+	@staticmethod
+	def format_line(row, sketch=None):
+		name, best, time = row
+		line = "{}\t{}\t{}".format(name, format_time(best), format_time(time))
+		if sketch:
+			line += "\t" + sketch.serialize()
+		return line
+
+	def load(self, data):
+		structure, lines = self.outline(self.split_lines(data))
+		groups = [list(group) for group in self.groups]
+		open_groups = [] # (indent, index in groups) of groups containing the current line
+		index = len(self.splits)
+		for indent, group in structure:
+			while open_groups and open_groups[-1][0] >= indent:
+				_, closed = open_groups.pop()
+				groups[closed][2] = index
+			if group is None:
+				index += 1
+			else:
+				open_groups.append((indent, len(groups)))
+				groups.append([group, index, None, len(open_groups) - 1])
+		for _, closed in open_groups:
+			groups[closed][2] = index
+		self.extend(
+			[self.parse_line(line) for line in lines],
+			[self.parse_sketch(line) for line in lines],
+			[tuple(group) for group in groups],
+		)
+
+	def extend(self, rows, sketches, groups):
+		"""Append the given rows and their sketches, and replace the groups with the given ones
+		(which may include the new rows)"""
+		self.splits.extend(rows)
+		self.sketches.extend(sketches)
+		self._set_groups(groups)
+		self.version += 1
 
 	def dump(self):
-		return '\n'.join("{}\t{}\t{}".format(name, format_time(best), format_time(time))
-		                 for name, best, time in self)
+		lines = []
+		for index, (row, sketch) in enumerate(zip(self.splits, self.sketches)):
+			for group in self.groups_at(index):
+				name, start, end, depth = self.groups[group]
+				lines.append(self.INDENT * depth + name)
+			lines.append(self.INDENT * self.depth(index) + self.format_line(row, sketch))
+		return '\n'.join(lines)
 
 	def loadfile(self, filepath):
+		if is_manifest(filepath):
+			# replaces rather than appends, as a marathon is made up of its games and nothing else
+			self.parts = [[part, None] for part in read_manifest(filepath)]
+			self._compose()
+			self.expand(0)
+			return
+		if is_database(filepath):
+			database = Database(filepath)
+			try:
+				rows, sketches, groups = database.load()
+			finally:
+				database.close()
+			offset = len(self)
+			self.extend(rows, sketches, self.groups + [
+				(name, start + offset, stop + offset, depth) for name, start, stop, depth in groups
+			])
+			return
 		with open(filepath) as f:
 			data = f.read()
 		self.load(data)
 
 	def savefile(self, filepath):
+		if is_manifest(filepath):
+			# only re-write the games which have changed
+			for part, splits in self.parts:
+				if splits is not None and splits != part.saved:
+					splits.savefile(part.filepath)
+					part.update(splits.copy())
+			write_manifest(filepath, [part for part, splits in self.parts])
+			return
+		if is_database(filepath):
+			database = Database(filepath)
+			try:
+				database.save(self)
+			finally:
+				database.close()
+			return
 		data = self.dump()
 		with open(filepath, 'w') as f:
 			f.write(data + '\n')
 
+	def _compose(self):
+		"""Re-build the rows of a marathon from its games. The best run times are those of each game's
+		best run, back to back."""
+		rows = []
+		sketches = []
+		groups = []
+		offset = 0 # time of the best runs of the games so far
+		for part, splits in self.parts:
+			start = len(rows)
+			group = len(groups)
+			groups.append(None) # filled in once we know where it ends, so groups stay outermost first
+			if splits is None:
+				rows.append((part.name, part.best, _add(offset, part.time)))
+				sketches.append(None)
+				offset = _add(offset, part.time)
+			else:
+				rows += [(name, best, _add(offset, time)) for name, best, time in splits]
+				sketches += splits.sketches
+				groups += [(name, first + start, end + start, depth + 1) for name, first, end, depth in splits.groups]
+				offset = _add(offset, splits[-1][2])
+			groups[group] = part.name, start, len(rows), 0
+		self.splits = rows
+		self.sketches = sketches
+		self._set_groups(groups)
+		self.version += 1
+
+	def _part_ranges(self):
+		"""For a marathon, return (start, end) of each game's splits"""
+		return [(start, end) for name, start, end, depth in self.groups if depth == 0]
+
+	def expand(self, index):
+		"""For a marathon, load the game containing the given split if it isn't already.
+		Games are loaded from disk only once, and shared between copies.
+		Returns whether the splits changed."""
+		if not self.parts:
+			return False
+		number = [start <= index < end for start, end in self._part_ranges()].index(True)
+		part, splits = self.parts[number]
+		if splits is not None:
+			return False
+		if part.saved is None:
+			saved = Splits(part.filepath)
+			if not len(saved):
+				raise ValueError('Splitfile {} has no splits'.format(part.filepath))
+			part.update(saved)
+		self.parts[number][1] = part.saved.copy()
+		self._compose()
+		return True
+
 	def append(self, name, best, time):
-		self.splits.append((name, best, time))
+		self.append_row((intern(name), best, time))
+
+	def append_row(self, row):
+		"""As append(), but takes an existing (name, best, time) row, which is shared rather than copied"""
+		self.splits.append(row)
+		self.sketches.append(None)
+		self._ancestors.append(())
+		self.version += 1
 
 	def pop(self):
-		return self.splits.pop()
+		self.version += 1
+		self.sketches.pop()
+		row = self.splits.pop()
+		self._ancestors.pop()
+		if self.groups and self.groups[-1][2] > len(self.splits):
+			# shrink (or remove, if now empty) the groups the split was in
+			self._set_groups([
+				(name, start, min(end, len(self.splits)), depth)
+				for name, start, end, depth in self.groups
+				if start < len(self.splits)
+			])
+		return row
+
+	def set_sketch(self, index, sketch):
+		self.sketches[index] = sketch
+		self.version += 1
 
 	def merge(self, new):
-		for n, ((name, our_best, time), (_, their_best, _)) in enumerate(zip(self, new)):
-			if our_best is None or their_best < our_best:
-				self.splits[n] = name, their_best, time
-		if len(self) != len(new):
-			return # don't update times for incomplete splits
-		_, _, our_time = self[-1]
-		_, _, their_time = new[-1]
-		if our_time is not None and their_time >= our_time:
-			return # they didn't beat us
-		for n, ((name, best, _), (_, _, time)) in enumerate(zip(self, new)):
-			self.splits[n] = name, best, time
+		"""Merge the rows of a (possibly incomplete) run into these splits in a single pass.
+		Best segment times are updated for any segment that beat them, and if the run was complete
+		and beat the best run, the best run times are replaced by the run's.
+		Every segment time is also added to that segment's sketch.
+		Returns a MergeResult describing what changed."""
+		if self.parts:
+			return self._merge_parts(new)
+		return self._merge(new, usable_segments([best for name, best, time in new]))
+
+	def _merge(self, new, segments):
+		"""As merge(), given the usable segment times of the run (see usable_segments())"""
+		result = MergeResult()
+		if len(self) == len(new):
+			_, _, our_time = self[-1]
+			_, _, their_time = new[-1]
+			if their_time is not None and (our_time is None or their_time < our_time):
+				result.pb = True
+				if our_time is not None:
+					result.pb_delta = their_time - our_time
+		for n, ((name, our_best, our_time), (_, _, their_time), segment) in enumerate(zip(self, new, segments)):
+			best, time = our_best, our_time
+			if segment is not None and (our_best is None or segment < our_best):
+				best = segment
+				result.golds.append((n, our_best, segment))
+			if result.pb:
+				time = their_time
+			if (best, time) != (our_best, our_time):
+				self[n] = name, best, time
+				result.changed.append(n)
+			if segment is not None:
+				self.set_sketch(n, (self.sketches[n] or QuantileSketch()).with_value(segment))
+				result.sampled.append(n)
+		return result
+
+	def _merge_parts(self, new):
+		"""As merge(), for a marathon. Each game the run reached is merged into that game's splits,
+		so each game keeps its own best run, and the marathon's best run is made up of them."""
+		result = MergeResult()
+		segments = usable_segments([best for name, best, time in new])
+		old_rows = self.splits
+		_, _, old_time = self[-1]
+		for (start, end), (part, splits) in zip(self._part_ranges(), self.parts):
+			if start >= len(new):
+				break
+			# the game's part of the run, timed from the start of the game
+			_, _, start_time = new[start - 1] if start else (None, None, 0)
+			run = Splits()
+			for name, best, time in new[start:end]:
+				run.append_row((name, best, None if start_time is None else _add(-start_time, time)))
+			changes = splits._merge(run, segments[start:end])
+			result.golds += [(index + start, old, new_best) for index, old, new_best in changes.golds]
+			result.sampled += [index + start for index in changes.sampled]
+		self._compose()
+		result.changed = [index for index, (old, row) in enumerate(zip(old_rows, self.splits)) if old != row]
+		_, _, time = self[-1]
+		if time is not None and (old_time is None or time < old_time):
+			result.pb = True
+			if old_time is not None:
+				result.pb_delta = time - old_time
+		return result
+
+
+def _add(time, other):
+	"""Add two times, either of which may be None for unknown"""
+	return None if time is None or other is None else time + other
+
+
+class MergeResult(object):
+	"""Describes the changes made by a Splits.merge()"""
+
+	def __init__(self):
+		self.golds = [] # list of (index, old best time, new best time) for segments that got a new best
+		self.pb = False # whether the run was a new best run
+		self.pb_delta = None # if pb, new final time minus old final time (None if there was no previous best run)
+		self.changed = [] # indexes of all rows that were modified
+		self.sampled = [] # indexes of all segments whose sketches were updated
+
+	def __nonzero__(self):
+		return bool(self.changed)
@@ -1,49 +1,89 @@
 
-from monotonic import monotonic
+import os
+import time
+import ctypes
+import ctypes.util
+
+
+SECOND = 10**9 # times are integer nanoseconds
+
+_librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+	_fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_ns():
+	ts = _timespec()
+	if _librt.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)):
+		err = ctypes.get_errno()
+		raise OSError(err, 'clock_gettime failed: {}'.format(os.strerror(err)))
+	return ts.tv_sec * SECOND + ts.tv_nsec
+
+
+# current time of the monotonic clock in integer nanoseconds, as per python 3's time.monotonic_ns
+monotonic_ns = getattr(time, 'monotonic_ns', _monotonic_ns)
 
 
 class Timer(object):
 	"""A stateful timer object that can be started, paused, and marked (see mark()).
 	Cannot be stopped or reset - just make a new one.
-	Uses monotonic time.
+	Uses monotonic time by default. All times are integer nanoseconds.
+	Most methods take an optional at argument, a clock time to use instead of the current time,
+	eg. the time a key was pressed as opposed to when we got around to handling it.
 	"""
 	extra_time = 0 # extra_time is a base value to add to elapsed time, used to implement pause
 	paused = False
 
-	def __init__(self):
-		self.start_time = monotonic()
+	def __init__(self, clock=monotonic_ns, listener=None, at=None):
+		"""clock is the function used to get the current time.
+		If given, listener(event, timestamp) is called for each start, pause, mark and unmark,
+		with the clock time at which it took effect."""
+		self.clock = clock
+		self.listener = listener
+		self.start_time = clock() if at is None else at
 		self.marks = [] # list of elapsed times that marks are made at - last entry is current mark
+		self._notify('start', self.start_time)
+
+	def _notify(self, event, timestamp):
+		if self.listener:
+			self.listener(event, timestamp)
 
-	def get(self):
+	def get(self, at=None):
 		"""Return the time elapsed since start"""
-		elapsed, now = self._get()
+		elapsed, now = self._get(at)
 		return elapsed
 
-	def _get(self):
+	def _get(self, at=None):
 		"""Retuns (elapsed since start, timestamp of when this elapsed time was retrieved)"""
-		now = monotonic()
+		now = self.clock() if at is None else at
 		elapsed = self.extra_time
 		if not self.paused:
 			elapsed += now - self.start_time
 		return elapsed, now
 
-	def pause(self):
+	def pause(self, at=None):
 		"""Toggle between paused and unpaused"""
+		elapsed, now = self._get(at)
 		if self.paused:
-			self.start_time = monotonic()
+			self.start_time = now
 			self.paused = False
 		else:
-			self.extra_time = self.get()
+			self.extra_time = elapsed
 			self.paused = True
+		self._notify('pause', now)
 
-	def mark(self, peek=False):
+	def mark(self, peek=False, at=None):
 		"""Marks the current time, and returns the elapsed time since the last mark.
 		If peek=True, return elapsed time without changing the mark."""
-		elapsed = self.get()
+		elapsed, now = self._get(at)
 		old_mark = self.marks[-1] if self.marks else 0
 		since_mark = elapsed - old_mark
 		if not peek:
 			self.marks.append(elapsed)
+			self._notify('mark', now)
 		return since_mark
 
 	def unmark(self):
@@ -56,38 +96,46 @@ class Timer(object):
 		"""
 		if self.marks:
 			self.marks.pop()
+		self._notify('unmark', self.clock())
 
 
 def parse_time(data):
-	"""Recognise [[H:]M:]S.s, or None for empty string"""
+	"""Recognise [-][[H:]M:]S[.s], returning integer nanoseconds, or None for empty string.
+	Fractions of a second are parsed exactly, and any digits past nanoseconds are dropped."""
 	data = data.strip()
 	if not data:
 		return None
 	try:
-		parts = data.split(':')
+		sign, unsigned = (-1, data[1:]) if data.startswith('-') else (1, data)
+		parts = unsigned.split(':')
 		if len(parts) > 3:
 			raise ValueError("Too many seperators")
 		parts, secs = parts[:-1], parts[-1]
-		parts = map(int, parts)
-		secs = float(secs)
+		whole, _, fraction = secs.partition('.')
+		if not (whole or fraction).isdigit() or (fraction and not fraction.isdigit()):
+			raise ValueError("Bad seconds value {!r}".format(secs))
+		ns = int(whole or 0) * SECOND + int(fraction[:9].ljust(9, '0'))
 		for i, part in enumerate(parts[::-1]):
-			secs += part * 60^(i+1) # i=0 for mins, i=1 for hours
+			ns += int(part) * 60**(i+1) * SECOND # i=0 for mins, i=1 for hours
 	except ValueError as ex:
 		raise ValueError("Cannot parse time {!r}: {}".format(data, ex))
-	return secs
+	return sign * ns
 
 
-def format_time(secs):
-	if secs is None:
+def format_time(ns, precision=3):
+	"""Format integer nanoseconds as [H:]MM:SS.sss, with precision decimal places (rounded to nearest)"""
+	if ns is None:
 		return '' # None is empty string
-	if not (float('-inf') <= secs < float('inf')):
-		# special cases: just stick with seconds
-		return "{:.3f}".format(secs)
-	if secs < 0:
-		return '-{}'.format(format_time(-secs))
-	hours, secs = int(secs / 3600), secs % 3600
-	mins, secs = int(secs / 60), secs % 60
-	ret = "{:02}:{:06.3f}".format(mins, secs)
+	if ns < 0:
+		return '-{}'.format(format_time(-ns, precision))
+	unit = 10**(9 - precision)
+	units = (ns + unit / 2) / unit # round before splitting into fields, so 59.9999 becomes 01:00.000
+	secs, fraction = divmod(units, 10**precision)
+	mins, secs = divmod(secs, 60)
+	hours, mins = divmod(mins, 60)
+	ret = "{:02}:{:02}".format(mins, secs)
+	if precision:
+		ret = "{}.{:0{}}".format(ret, fraction, precision)
 	if hours:
 		ret = "{:02}:{}".format(hours, ret)
 	return ret
@@ -1,7 +1,11 @@
 
+import os
 import sys
 import errno
-from termios import ECHO, ECHONL, ICANON
+import fcntl
+import signal
+import struct
+from termios import ECHO, ECHONL, ICANON, TIOCGWINSZ
 
 import gevent.event
 import gevent.socket
@@ -12,71 +16,171 @@ import gevent.queue
 import gtools
 from termhelpers import TermAttrs
 
-from termsplit.timing import Timer, format_time
+
+from termsplit.timing import Timer, format_time, monotonic_ns
 from termsplit.splits import Splits
 from termsplit.keys import KeyPresses
+from termsplit.readers import add_reader
+from termsplit.watch import FileWatcher
+from termsplit.journal import Journal
+from termsplit.output import FrameBuffer, NonBlockingFrameBuffer
+from termsplit.profiling import Profiler
+from termsplit.history import History
+from termsplit.database import Database, DatabaseHistory, is_database
+from termsplit.marathon import is_manifest
+from termsplit.predict import Predictor
+from termsplit.columns import COLUMNS, row_format
+from termsplit.comparisons import Comparisons
 
 STDIN_KEYS = {
 	'h': 'HELP',
 	'q': 'QUIT',
 	's': 'SAVE',
 	'r': 'REDRAW',
+	'p': 'PROFILE',
+	'c': 'COMPARE',
 }
 
 CLEAR = '\x1b[H\x1b[2J'
 CLEAR_LINE = '\x1b[2K\x1b[G'
+CLEAR_BELOW = '\x1b[J'
+SAVE_CURSOR = '\x1b7'
+RESTORE_CURSOR = '\x1b8'
+MOVE_CURSOR = '\x1b[{};1H' # move to start of given (1-based) line
+MOVE_TO_COLUMN = '\x1b[{}G' # move to given (1-based) column of the current line
+CLEAR_TO_END = '\x1b[K'
+SPLITS_TOP = 3 # screen line of the first row of the splits table, see preamble()
 
 class Quit(gevent.GreenletExit):
 	pass
 
 
+def terminal_height(fd):
+	"""Return the number of lines in the terminal, or None if unknown (eg. not a terminal)"""
+	try:
+		rows, cols, _, _ = struct.unpack('HHHH', fcntl.ioctl(fd, TIOCGWINSZ, '\0' * 8))
+	except IOError:
+		return None
+	return rows or None
+
+
+def time_diff(o_time, r_time, precision=3):
+	"""Compare a result time to an original time, for display"""
+	if r_time is None:
+		# r_time is None, no comparison
+		return '-'
+	elif o_time is None:
+		# if original is None, return (result)
+		return '({})'.format(format_time(r_time, precision))
+	else:
+		return r_time - o_time
+
+
 class UI(object):
-	INTERVAL = 0.01 # time between updates
-	HEADER = ['Name', 'Seg Time', 'Best Seg', 'PB Seg', 'Time', 'PB Time'] # column names
 	SPLITS_HEADER = ['Name', 'Best Seg', 'PB Time']
 	MSG_DISPLAY_DELAY = 0.5 # How long to pause output to let a message display before clearing
 
-	def __init__(self, config, splits, filepath=None):
-		self.config = config
+	def __init__(self, config, splits, filepath=None, nonblocking_output=False, profile=False,
+		capture_input=False, input_priority=False):
+		"""If nonblocking_output is set, output never blocks on the terminal (see NonBlockingFrameBuffer),
+		so a stalled terminal can't hold up input or timing. Stale frames may be dropped.
+		If profile is set, start with profiling enabled (see profile()).
+		capture_input and input_priority are passed to KeyPresses."""
+		self.config = config # a Config
+		self.capture_input = capture_input
+		self.input_priority = input_priority
 		self.filepath = filepath
+		self._columns = [COLUMNS[column][1:] for column in config.columns] # (value, reference) of each column
+		self._row_formats = {} # {widths: format string}, see get_row_format()
+		self.history = None # segment times of all attempts
+		if filepath and is_database(filepath):
+			self.history = DatabaseHistory(Database(filepath))
+		elif filepath and not is_manifest(filepath): # a marathon's games aren't all loaded, so can't be lined up
+			self.history = History(filepath + '.history')
+		self.seed_sketches(splits)
+		self.predictor = Predictor.from_splits(splits)
+		self.comparisons = Comparisons(config.comparisons, self.history)
+		self.header = self.get_header() # results table column names
 
 		# splits is up-to-date splits, saved is what was last saved to file,
 		# results is this run (instead of best times)
 		self.splits = splits
 		self.saved = splits.copy()
 		self.results = None
+		# only plain splitfiles can be reloaded, see reload()
+		self.reloadable = bool(filepath) and not is_database(filepath) and not is_manifest(filepath)
+		self._file_lines = self.read_file_lines() or [] # splitfile contents as of last load or save
+		self._reload_pending = False # whether the splitfile changed structurally and needs a full reload
+		self._splits_widths = None # widths the splits table was last drawn with
+		self._layout = None # the get_layout() the screen was last drawn with
+		self.height = None # terminal height as of last clear(), or None for unlimited
+		self._cache = {} # values derived from self.splits, see cached()
+		self._cache_key = None, None # (splits, version) the cache is valid for
+
+		# what needs redrawing, see invalidate()
+		self._stale = set()
+		self._stale_rows = set()
+		self._invalidated = gevent.event.Event()
+		self._drawn_results = None # number of results drawn, or None if results aren't displayed
+		self._current = None # reference times for the current row, see draw_current()
+		self._current_widths = None
+		self._drawn_prediction = None # prediction text currently on screen
 
 		self._group = gevent.pool.Group()
 		self._input_queue = gevent.queue.Queue()
+		self._stdin_closed = gevent.event.AsyncResult() # raises EOFError once stdin is closed
 		self._output_lock = gevent.lock.RLock()
+		# all output goes through here, one write per frame
+		if nonblocking_output:
+			self.out = NonBlockingFrameBuffer(sys.stdout.fileno(), on_overflow=lambda: self._input_queue.put(('REDRAW', None)))
+		else:
+			self.out = FrameBuffer(sys.stdout.fileno())
+		self.split_writes = 0 # number of writes made to draw the most recent split
 		self.running = gevent.event.Event() # whether time is being counted
+		self.clock = monotonic_ns # clock for timers, may be replaced (eg. by a simulated clock for testing)
+		self.sleep = gevent.sleep # used for all waiting on time to pass, replaced along with clock
 		self.timer = None # is None only before starting / after finishing
 
+		self.profiler = Profiler([
+			(self, 'compare'),
+			(self, 'get_widths'),
+			(self, 'convert_row'),
+			(sys.modules[__name__], 'format_time'),
+			(self, 'print_row'),
+			(self, 'render'),
+		])
+		if profile:
+			self.profiler.enable()
+		self.journal = Journal(filepath + '.journal') if filepath else None # for recovering the current run
+
 	def get_input(self):
-		"""Wait for an input from either global hotkeys or stdin, and return the associated action"""
+		"""Wait for an input from either global hotkeys or stdin, and return (action, timestamp).
+		timestamp is the time a hotkey was pressed, or None for other inputs."""
 		return self._input_queue.get()
 
 	def _read_stdin(self):
-		while True:
-			try:
-				r, w, x = gevent.select.select([sys.stdin], [], [])
-			except EnvironmentError as ex:
-				if ex.errno != errno.EINTR:
-					raise
-				continue
-			if r:
-				c = sys.stdin.read(1)
-				if not c:
-					raise EOFError
-				if c in STDIN_KEYS:
-					self._input_queue.put(STDIN_KEYS[c])
+		"""Called from the event loop when stdin is readable"""
+		try:
+			data = os.read(sys.stdin.fileno(), 64)
+		except EnvironmentError as ex:
+			if ex.errno in (errno.EINTR, errno.EAGAIN):
+				return # we'll be called again
+			self._stdin_watcher.stop()
+			self._stdin_closed.set_exception(ex)
+			return
+		if not data:
+			self._stdin_watcher.stop()
+			self._stdin_closed.set_exception(EOFError())
+			return
+		for c in data:
+			if c in STDIN_KEYS:
+				self._input_queue.put((STDIN_KEYS[c], None))
 
 	def _read_hotkeys(self):
 		while True:
-			key = self.hotkeys.next()
-			reverse_config = {v: k for k, v in self.config.items()}
-			if key in reverse_config:
-				self._input_queue.put(reverse_config[key])
+			key, timestamp = self.hotkeys.next_timed()
+			if key in self.config.key_actions:
+				self._input_queue.put((self.config.key_actions[key], timestamp))
 
 	def output_wrapper(self):
 		"""During timing, the state of the screen is somewhat tricky to manage.
@@ -88,7 +192,7 @@ class UI(object):
 		class _output_wrapper(object):
 			def __enter__(wrapper):
 				self._output_lock.acquire()
-				print
+				self.out.writeline()
 			def __exit__(wrapper, *exc_info):
 				if exc_info == (None, None, None):
 					self.clear()
@@ -97,37 +201,93 @@ class UI(object):
 
 	def clear(self):
 		"""Clear the screen and re-write the preamble"""
-		sys.stdout.write(CLEAR) # goto (0,0) and clear screen
+		self.height = terminal_height(self.out.fd)
+		self.out.write(CLEAR) # goto (0,0) and clear screen
 		self.preamble()
-		sys.stdout.flush()
+		self.out.flush(full=True)
 
 	def compare(self, split_index, result):
 		"""Takes a splits row, and a results row, and returns a row describing the difference"""
-		name, best_seg, pb_time = self.splits[split_index]
-		pb_seg = self.splits.best_run_segment_time(split_index)
 		_, result_seg, result_time = result
+		return [self.display_name(split_index)] + self.compare_values(self.get_references(split_index), result_seg, result_time)
+
+	def compare_group(self, group):
+		"""As compare(), but for the combined results of a finished group of splits"""
+		name, start, end, depth = self.splits.groups[group]
+		start_time = self.results[start - 1][2] if start else 0
+		_, _, end_time = self.results[end - 1]
+		seg = None if start_time is None or end_time is None else end_time - start_time
+		return [Splits.INDENT * depth + name] + self.compare_values(self.get_references(start, group), seg, end_time)
+
+	def compare_row(self, row):
+		"""Return the compare row for a row of the results table (see get_result_rows())"""
+		index, group = row
+		if group is None:
+			return self.compare(index, self.results[index])
+		return self.compare_group(group)
+
+	def display_name(self, split_index):
+		"""Name of the split, indented by how deeply it is grouped"""
+		name, _, _ = self.splits[split_index]
+		return Splits.INDENT * self.splits.depth(split_index) + name
+
+	def splits_row(self, split_index):
+		"""Return the row of the splits table for the given split"""
+		_, best, time = self.splits[split_index]
+		return self.display_name(split_index), best, time
+
+	def compare_values(self, references, seg, time):
+		"""Return the cells of the configured columns, after the name, for the given segment and total time.
+		references is as per get_references()."""
+		values = {'seg': seg, 'time': time}
+		return [
+			values[value] if reference is None else time_diff(reference_time, values[value], self.config.precision)
+			for (value, reference), reference_time in zip(self._columns, references)
+		]
 
-		def diff(o_time, r_time):
-			if r_time is None:
-				# r_time is None, no comparison
-				return '-'
-			elif o_time is None:
-				# if original is None, return (result)
-				return '({})'.format(format_time(r_time))
-			else:
-				return r_time - o_time
-
+	def get_references(self, split_index, group=None):
+		"""Return the time each configured column compares against for the given split,
+		or for the given group (which starts at split_index) as a whole.
+		Only the references actually shown are looked up."""
 		return [
-			name,
-			result_seg,
-			diff(best_seg, result_seg),
-			diff(pb_seg, result_seg),
-			result_time,
-			diff(pb_time, result_time),
+			None if reference is None else self.get_reference(reference, split_index, group)
+			for value, reference in self._columns
 		]
 
-	def get_compare_rows(self, results):
-		return [self.compare(idx, result) for idx, result in enumerate(results)]
+	def get_reference(self, reference, split_index, group=None):
+		last = split_index if group is None else self.splits.groups[group][2] - 1
+		name, best_seg, pb_time = self.splits[last]
+		if reference == 'best_seg':
+			return best_seg if group is None else self.splits.group_best(group)
+		if reference == 'pb_seg':
+			if group is None:
+				return self.splits.best_run_segment_time(split_index)
+			return self.splits.group_best_run_segment_time(group)
+		if reference == 'pb_time':
+			return pb_time
+		if reference == 'sum_of_best':
+			segments, times = self.comparisons.get(self.splits, 'sum_of_best')
+			return times[last]
+		if reference == 'comparison_seg':
+			segments, times = self.comparisons.get(self.splits)
+			if group is None:
+				return segments[split_index]
+			start_time = times[split_index - 1] if split_index else 0
+			return None if start_time is None or times[last] is None else times[last] - start_time
+		if reference == 'comparison_time':
+			segments, times = self.comparisons.get(self.splits)
+			return times[last]
+		raise ValueError('Unknown reference: {!r}'.format(reference))
+
+	def get_header(self):
+		return ['Name'] + [COLUMNS[column][0].format(self.comparisons.name) for column in self.config.columns]
+
+	def next_comparison(self):
+		"""Switch to comparing against the next comparison target. As its times are cached
+		(see Comparisons), switching back and forth only costs a redraw."""
+		self.comparisons.cycle()
+		self.header = self.get_header()
+		self.invalidate('all')
 
 	def main(self):
 		"""Run the main UI for the given splits.
@@ -136,35 +296,114 @@ class UI(object):
 		"live" operations like splitting and pausing, whereas stdin is used for administrative operations like
 		saving the splitfile or reconfiguring."""
 		with TermAttrs.modify(exclude=(0,0,0,ECHO|ECHONL|ICANON)): # don't echo input, one-char-at-a-time
-			self.hotkeys = KeyPresses()
+			self.hotkeys = KeyPresses(capture=self.capture_input, priority=self.input_priority)
+
+			events = self.journal.read() if self.journal else None
+			if events:
+				self.restore(events)
 
+			sys.stdout.flush() # anything written before we took over output
 			self.clear()
-			sys.stdout.flush()
 
-			self._group.spawn(self._read_stdin)
+			self._stdin_watcher = add_reader(sys.stdin.fileno(), self._read_stdin)
 			self._group.spawn(self._read_hotkeys)
 			self._group.spawn(self.input_loop)
 			self._group.spawn(self.output_loop)
+			self._group.spawn(self.tick_loop)
+			if self.reloadable:
+				self._group.spawn(self._watch_splitfile)
+			gevent.signal_handler(signal.SIGWINCH, self._input_queue.put, ('REDRAW', None))
 
 			# raise if any greenlet fails, continue if Quit raised
 			try:
-				gtools.get_first([g.get for g in self._group.greenlets])
+				gtools.get_first([g.get for g in self._group.greenlets] + [self._stdin_closed.get])
 			finally:
+				self._stdin_watcher.stop()
 				if self.saved != self.splits:
-					print
-					print 'Exiting with unsaved changes! Dumping splitfile:'
-					print self.splits.dump()
+					self.out.writeline()
+					self.out.writeline('Exiting with unsaved changes! Dumping splitfile:')
+					self.out.writeline(self.splits.dump())
 				self._group.kill()
-				print
+				self.hotkeys.close()
+				if self.journal:
+					self.journal.close()
+				self.out.writeline()
+				self.out.flush()
+				self.out.close()
+
+	def cached(self, key, func):
+		"""Return func(), cached until self.splits is next modified"""
+		splits, version = self._cache_key
+		if splits is not self.splits or version != self.splits.version:
+			self._cache = {}
+			self._cache_key = self.splits, self.splits.version
+		if key not in self._cache:
+			self._cache[key] = func()
+		return self._cache[key]
+
+	def get_layout(self, num_results=None):
+		"""Work out which rows of the splits and results tables fit on screen,
+		so that the cost of a redraw is bounded by terminal height and not by the length of the splits.
+		Returns (splits start, splits count, results start, results count).
+		If everything fits, everything is shown. Otherwise the splits table is centered on the current split,
+		and the results table shows the most recent results. Results start and count are in rows of the
+		results table, which may be fewer than the results if groups are collapsed (see get_result_rows()).
+		num_results may be given to get the layout as it would be with only that many results."""
+		num_splits = len(self.splits)
+		if num_results is None:
+			num_results = len(self.results) if self.results is not None else 0
+		num_rows = len(self.get_result_rows(num_results))
+		if self.height is None:
+			return 0, num_splits, 0, num_rows
+		# title, splits header, two blank lines, a line for the cursor to end up on,
+		# plus results header while there are results and the current row while running
+		available = max(0, self.height - 5 - (self.results is not None) - bool(self.timer))
+		if num_splits + num_rows <= available:
+			return 0, num_splits, 0, num_rows
+		results_count = min(num_rows, available / 2)
+		splits_count = min(num_splits, available - results_count)
+		results_count = min(num_rows, available - splits_count)
+		splits_start = max(0, min(num_results - splits_count / 2, num_splits - splits_count))
+		return splits_start, splits_count, num_rows - results_count, results_count
+
+	def get_result_rows(self, num_results=None):
+		"""Return the rows of the results table for the first num_results results (default all),
+		as (split index, group index or None). If collapse_groups is set, each finished group
+		is a single row (outermost groups first), otherwise every result has its own row."""
+		if num_results is None:
+			num_results = len(self.results) if self.results is not None else 0
+		if not (self.config.collapse_groups and self.splits.groups):
+			return [(index, None) for index in range(num_results)]
+		rows = []
+		index = 0
+		while index < num_results:
+			finished = [group for group in self.splits.groups_at(index) if self.splits.groups[group][2] <= num_results]
+			if finished:
+				rows.append((index, finished[0]))
+				index = self.splits.groups[finished[0]][2]
+			else:
+				rows.append((index, None))
+				index += 1
+		return rows
 
 	def preamble(self):
-		print "Current times:"
+		self._layout = self.get_layout()
+		self.out.writeline("Current times:")
 		self.print_splits()
-		print
-		print
-		if self.timer: # if started
-			self.print_results(self.get_compare_rows(self.results))
-			self.print_current()
+		self._drawn_prediction = self.get_prediction() if self.timer else None
+		self.out.writeline(self._drawn_prediction or '')
+		self.out.writeline()
+		self._drawn_results = None
+		if self.results is not None: # if started
+			self.print_results(self.get_visible_results())
+			self._drawn_results = len(self.results)
+		if self.timer: # if running
+			self.draw_current()
+
+	def get_visible_results(self):
+		"""Return compare rows for the results shown by the current layout"""
+		_, _, start, count = self._layout
+		return [self.compare_row(row) for row in self.get_result_rows()[start:start + count]]
 
 	def get_widths(self, header, rows, min_widths=None):
 		"""Given a list of rows, returns the max width for the first two columns."""
@@ -175,96 +414,186 @@ class UI(object):
 		return longest
 
 	def get_result_widths(self, rows):
-		all_equal = [self.compare(idx, split) for idx, split in enumerate(self.splits)]
-		min_widths = self.get_widths(self.HEADER, all_equal)
-		return self.get_widths(self.HEADER, rows, min_widths)
+		min_widths = self.cached(('result_widths', self.comparisons.current), lambda: self.get_widths(
+			self.header, [self.compare(idx, split) for idx, split in enumerate(self.splits)]
+		))
+		return self.get_widths(self.header, rows, min_widths)
+
+	def get_splits_widths(self):
+		return self.cached('splits_widths', lambda: self.get_widths(
+			self.SPLITS_HEADER, [self.splits_row(index) for index in range(len(self.splits))]
+		))
 
 	def convert_row(self, row):
-		return [v if isinstance(v, str) else format_time(v) for v in row]
+		return [v if isinstance(v, str) else format_time(v, self.config.precision) for v in row]
 
 	def print_splits(self):
-		widths = self.get_widths(self.SPLITS_HEADER, self.splits)
+		widths = self.get_splits_widths()
+		self._splits_widths = widths
 		self.print_row(widths, self.SPLITS_HEADER)
-		for row in self.splits:
-			self.print_row(widths, row)
+		start, count, _, _ = self._layout
+		for index in range(start, start + count):
+			self.print_row(widths, self.splits_row(index))
 
 	def print_results(self, rows):
 		widths = self.get_result_widths(rows)
-		self.print_row(widths, self.HEADER)
+		self.print_row(widths, self.header)
 		for row in rows:
 			self.print_row(widths, row)
 
-	def get_current_row(self, split=False):
-		"""Return the times for the current row. If split=True, begin the next split.
+	def get_current_row(self, split=False, at=None):
+		"""Return the times for the current row, as of clock time at (default now).
+		If split=True, begin the next split.
 		(if splitting were a seperate operation, a small delay would be introduced between get() and mark())
 		"""
+		if at is None:
+			at = self.timer.clock()
 		name, _, _ = self.splits[len(self.results)] # next split after the ones in results
-		return name, self.timer.mark(peek=not split), self.timer.get()
+		return name, self.timer.mark(peek=not split, at=at), self.timer.get(at)
 
-	def print_current(self, current=None):
-		"""Print times for the current split based on self.timer.
-		Does NOT end with a newline."""
+	def draw_current(self):
+		"""Print times for the current split based on self.timer, and prepare everything draw_time()
+		needs to update it. Does NOT end with a newline."""
 		split_index = len(self.results) # next split after the ones in results
-		if not current:
-			current = self.get_current_row()
-		widths = self.get_result_widths(self.get_compare_rows(list(self.results) + [current]))
-		self.print_row(widths, self.compare(split_index, current), newline=False)
+		self._current = self.get_references(split_index)
+		_, seg, time = self.get_current_row()
+		current = [self.display_name(split_index)] + self.compare_values(self._current, seg, time)
+		self._current_widths = self.get_result_widths(self.get_visible_results() + [current])
+		self.out.write(CLEAR_LINE)
+		self.print_row(self._current_widths, current, newline=False)
+		self.draw_prediction()
+
+	def draw_time(self):
+		"""Redraw only the time-dependent cells of the current row, using the comparison times and widths
+		prepared by the last draw_current(). Assumes the cursor is still on the current row."""
+		seg, time = self.timer.mark(peek=True), self.timer.get()
+		cells = self.convert_row(self.compare_values(self._current, seg, time))
+		name_width = self._current_widths[0]
+		widths = self._current_widths[1:]
+		if any(len(cell) > width for cell, width in zip(cells, widths)):
+			self.draw_current() # values have outgrown their columns
+			return
+		self.out.write(MOVE_TO_COLUMN.format(name_width + 3) + CLEAR_TO_END)
+		self.out.write(self.get_row_format(widths).format(*cells))
+		self.draw_prediction(seg, time)
+
+	def get_prediction(self, seg=None, time=None):
+		"""Return text describing the projected final time of the current run, or None if unknown.
+		seg and time are the current segment time and total time, if already known."""
+		if not self.predictor:
+			return None
+		if seg is None:
+			seg, time = self.timer.mark(peek=True), self.timer.get()
+		_, _, pb_time = self.splits[-1]
+		prediction = self.predictor.predict(len(self.results), time - seg, seg, pb_time)
+		if prediction is None:
+			return None
+		projected, chance = prediction
+		text = 'Projected: {}'.format(format_time(projected, self.config.precision))
+		if chance is not None:
+			text += '  PB chance: {:.0%}'.format(chance)
+		return text
+
+	def draw_prediction(self, seg=None, time=None):
+		"""Update the prediction line (the first blank line after the splits table), if it has changed.
+		Does not move the cursor."""
+		text = self.get_prediction(seg, time)
+		if text == self._drawn_prediction:
+			return
+		_, count, _, _ = self._layout
+		self.out.write(SAVE_CURSOR + MOVE_CURSOR.format(SPLITS_TOP + count) + CLEAR_LINE + (text or '') + RESTORE_CURSOR)
+		self._drawn_prediction = text
+
+	def get_row_format(self, widths):
+		"""Return the format string for rows with the given widths, building it only when the widths change"""
+		widths = tuple(widths)
+		if widths not in self._row_formats:
+			if len(self._row_formats) > 64:
+				self._row_formats.clear() # widths have changed a lot, eg. after many reloads
+			self._row_formats[widths] = row_format(widths)
+		return self._row_formats[widths]
 
 	def print_row(self, widths, row, newline=True):
 		"""Print the given row with padding to fit columns"""
-		row = self.convert_row(row)
-		row = "  ".join(
-			"{value:<{width}}".format(width=width, value=value)
-			for width, value in zip(widths, row)
-		)
+		row = self.get_row_format(widths).format(*self.convert_row(row))
 		if newline:
 			row += "\n"
-		sys.stdout.write(row)
+		self.out.write(row)
 
 	def save(self):
 		with self.output_wrapper():
+			if self._reload_pending:
+				# the file has changed in a way we couldn't pick up (see reload()), don't silently throw that away
+				(save_key,) = [key for key, action in STDIN_KEYS.items() if action == "SAVE"]
+				self.out.writeline('{} has been changed since it was loaded, and saving would overwrite those changes.'.format(self.filepath))
+				self.out.writeline("Press {} again to overwrite it anyway, or anything else to cancel".format(save_key))
+				self.out.flush()
+				# as per help(), block until any input. If it's another SAVE, consume it and carry on.
+				# Otherwise leave it for the main input loop.
+				if self._input_queue.peek()[0] != "SAVE":
+					return
+				self.get_input()
 			self._save()
-			gevent.sleep(self.MSG_DISPLAY_DELAY)
+			self.sleep(self.MSG_DISPLAY_DELAY)
 
 	def _save(self):
 		self.splits.savefile(self.filepath)
 		# remember the new save details
 		self.saved = self.splits.copy()
-		print 'Saved to {}'.format(self.filepath)
+		self._file_lines = self.read_file_lines() or []
+		self._reload_pending = False
+		self.out.writeline('Saved to {}'.format(self.filepath))
+		self.out.flush()
 
 	def help(self):
 		with self.output_wrapper():
-			print "Help:"
+			self.out.writeline("Help:")
 			for key, action in STDIN_KEYS.items():
-				print "\t{}: {}".format(key, action)
-			for action, key in self.config.items():
-				print "\t{}: [global] {}".format(key, action)
+				self.out.writeline("\t{}: {}".format(key, action))
+			for action, key in self.config.bindings.items():
+				self.out.writeline("\t{}: [global] {}".format(key, action))
 			(help_key,) = [key for key, action in STDIN_KEYS.items() if action == "HELP"]
-			print "Press {} again to dismiss".format(help_key)
+			self.out.writeline("Press {} again to dismiss".format(help_key))
+			self.out.flush()
 			# Block until any input.
 			# If it's another HELP, consume it. Otherwise leave it for the main input loop.
-			if self._input_queue.peek() == "HELP":
+			if self._input_queue.peek()[0] == "HELP":
 				self.get_input()
 
-	def split(self):
+	def profile(self):
+		"""Toggle profiling of the functions involved in drawing frames.
+		When turning it off, show what was collected."""
+		if not self.profiler.enabled:
+			self.profiler.enable()
+			return
+		self.profiler.disable()
+		with self.output_wrapper():
+			for line in self.profiler.report():
+				self.out.writeline(line)
+			self.out.writeline('Output: {0.frames} frames, {0.writes} writes, {0.bytes} bytes, {1} writes for last split'.format(
+				self.out, self.split_writes,
+			))
+			(profile_key,) = [key for key, action in STDIN_KEYS.items() if action == "PROFILE"]
+			self.out.writeline("Press {} again to dismiss and resume profiling".format(profile_key))
+			self.out.flush()
+			# as per help(), block until any input and consume it if it's another PROFILE
+			if self._input_queue.peek()[0] == "PROFILE":
+				self.get_input()
+				self.profiler.enable()
+
+	def split(self, at=None):
 		if not self.timer:
 			if self.results is not None:
 				return # post-finish, do nothing (must hit reset to begin a new run)
-			self.start() # start the clock!
+			self.start(at) # start the clock!
 			return
 		# record the time for this split
-		with self._output_lock:
-			current = self.get_current_row(split=True)
-			# refresh current line to make sure it's up to date
-			sys.stdout.write(CLEAR_LINE)
-			self.print_current(current)
-			print # add a newline to begin next split's line
-			self.results.append(*current)
-			if len(self.results) == len(self.splits):
-				# run over
-				self.finish()
-			else:
-				self.print_current() # now print the new split
+		self.results.append_row(self.get_current_row(split=True, at=at))
+		if len(self.results) == len(self.splits):
+			# run over
+			self.finish()
+		self.invalidate('results')
+		self.expand()
 
 	def unsplit(self):
 		if not self.timer:
@@ -273,81 +602,318 @@ class UI(object):
 			return # can't unsplit the first split
 		self.timer.unmark()
 		self.results.pop()
-		self.clear()
+		self.invalidate('all')
 
-	def skip(self):
+	def skip(self, at=None):
 		if not self.timer:
 			return # not running, do nothing
 		if len(self.results) == len(self.splits) - 1:
 			return # can't skip final split
-		with self._output_lock:
-			# replace current line with empty
-			name, _, _ = self.get_current_row()
-			current = (name, None, None)
-			sys.stdout.write(CLEAR_LINE)
-			self.print_current(current)
-			self.results.append(*current)
-			print # next line for next split
-			self.print_current()
-
-	def start(self):
+		# record an empty result for this split
+		name, _, _ = self.splits[len(self.results)]
+		if self.journal:
+			self.journal.record('skip', self.timer.clock() if at is None else at)
+		self.results.append(name, None, None)
+		self.invalidate('results')
+		self.expand()
+
+	def start(self, at=None):
 		self.results = Splits()
-		self.timer = Timer()
+		if self.journal:
+			self.journal.begin()
+		self.timer = Timer(self.clock, listener=self.journal.record if self.journal else None, at=at)
 		self.running.set()
-		self.clear()
+		self.invalidate('all')
+
+	def expand(self):
+		"""For a marathon, load the game the run has reached, if it isn't already (see Splits.expand())"""
+		index = len(self.results)
+		if index < len(self.splits) and self.splits.expand(index):
+			self.saved.expand(index)
+			self.predictor = Predictor.from_splits(self.splits)
+			self.invalidate('all')
 
 	def finish(self):
+		if self.journal and self.timer:
+			self.journal.record('finish', self.timer.clock())
 		self.timer = None
 		self.running.clear()
 
+	def restore(self, events):
+		"""Rebuild an interrupted run from the events recorded in its journal, by replaying them
+		against a Timer whose clock returns each event's timestamp.
+		The journal is then re-written (with timestamps now relative to the current boot) and continued."""
+		replay_time = [None]
+		clock = lambda: replay_time[0]
+		for event, timestamp in events:
+			replay_time[0] = timestamp
+			if event == 'start':
+				self.results = Splits()
+				self.timer = Timer(clock)
+			elif not self.timer:
+				continue # not running, eg. finished but not yet reset
+			elif event == 'finish':
+				self.timer = None
+			elif event == 'pause':
+				self.timer.pause()
+			elif event == 'unmark':
+				if self.results:
+					self.timer.unmark()
+					self.results.pop()
+			elif len(self.results) >= len(self.splits):
+				continue # no split to replay against (eg. the splitfile has since been shortened)
+			elif event == 'mark':
+				self.results.append_row(self.get_current_row(split=True))
+				self.expand()
+			elif event == 'skip':
+				name, _, _ = self.splits[len(self.results)]
+				self.results.append(name, None, None)
+				self.expand()
+		if self.timer and len(self.results) >= len(self.splits):
+			self.timer = None # every split was replayed, but the finish wasn't recorded
+		if self.results is None:
+			return
+		self.journal.begin(events)
+		if self.timer:
+			self.timer.clock = self.clock
+			self.timer.listener = self.journal.record
+			if not self.timer.paused:
+				self.running.set()
+
 	def reset(self):
 		if self.results is None:
 			return # already reset
 		self.finish()
-		self.splits.merge(self.results)
+		if self.history and self.results:
+			self.history.append([segment for name, segment, time in self.results])
+		changes = self.splits.merge(self.results)
+		for index in changes.sampled:
+			self.predictor.update(index, self.splits.sketches[index])
 		self.results = None
-		self.clear()
+		if self.journal:
+			self.journal.discard()
+		if self._reload_pending:
+			self.reload()
+		self.invalidate('results', rows=changes.changed)
 
-	def pause(self):
+	def pause(self, at=None):
 		if not self.timer:
 			return # not started - do nothing
-		self.timer.pause() # toggle pause
+		self.timer.pause(at) # toggle pause
 		if self.timer.paused:
 			self.running.clear()
+			self.invalidate('time') # show the exact time we paused at
 		else:
 			self.running.set()
 
 	def quit(self):
 		raise Quit
 
+	def _watch_splitfile(self):
+		try:
+			watcher = FileWatcher(self.filepath)
+		except EnvironmentError:
+			return # can't watch (eg. no inotify), carry on without
+		try:
+			while True:
+				watcher.wait()
+				self.reload()
+		finally:
+			watcher.close()
+
+	def seed_sketches(self, splits):
+		"""If splits has no sketches (eg. it is from before we kept them, or hand-written),
+		summarize past attempts into them"""
+		if self.history and splits and not any(splits.sketches):
+			for index, sketch in enumerate(self.history.sketches(len(splits))):
+				splits.set_sketch(index, sketch)
+
+	def read_file_lines(self):
+		"""Return the lines of the splitfile as they are on disk (see Splits.split_lines()),
+		or None if it isn't a reloadable splitfile or can't be read"""
+		if not self.reloadable:
+			return None
+		try:
+			with open(self.filepath) as f:
+				return Splits.split_lines(f.read())
+		except EnvironmentError:
+			return None
+
+	def reload(self):
+		"""Pick up external edits to the splitfile.
+		Only lines that differ from what we last read or wrote are re-parsed, and only those rows are redrawn.
+		Rows with unsaved changes of our own are kept (the next save will write them), but still marked
+		as changed relative to the file.
+		If rows were added, removed or regrouped, we can't line them up with the current run, so the reload
+		is deferred until there is no run in progress and no unsaved changes."""
+		lines = self.read_file_lines()
+		if lines is None:
+			return # file is mid-replace or gone, we'll be told again when it's back
+		try:
+			old_structure, old_lines = Splits.outline(self._file_lines)
+			structure, split_lines = Splits.outline(lines)
+			if structure != old_structure:
+				if self.results is not None or self.saved != self.splits:
+					self._reload_pending = True
+					return
+				splits = Splits()
+				splits.load('\n'.join(lines))
+				self.seed_sketches(splits)
+				self.splits = splits
+				self.saved = splits.copy()
+				self.predictor = Predictor.from_splits(splits)
+				self._file_lines = lines
+				self._reload_pending = False
+				self.invalidate('all')
+				return
+			changed = [
+				(index, Splits.parse_line(new), Splits.parse_sketch(new))
+				for index, (old, new) in enumerate(zip(old_lines, split_lines))
+				if old != new
+			]
+		except ValueError:
+			return # file is half-edited or invalid, wait for the next change
+		self._file_lines = lines
+
+		redraw = []
+		for index, row, sketch in changed:
+			if self.saved[index] == self.splits[index]:
+				self.splits[index] = row
+				redraw.append(index)
+			self.saved[index] = row
+			if sketch is None:
+				continue # line has no sketch (eg. hand-written), keep the one we have from history
+			if self.saved.sketches[index] == self.splits.sketches[index]:
+				self.splits.set_sketch(index, sketch)
+				self.predictor.update(index, sketch)
+			self.saved.set_sketch(index, sketch)
+		self.invalidate(rows=redraw)
+
+	def invalidate(self, region=None, rows=()):
+		"""Mark part of the screen as out of date, to be redrawn by the output loop. Regions are:
+			all: everything
+			results: results have been added or removed since the results table was drawn
+			current: the current row, eg. because what it is compared against has changed
+			time: only the time-dependent cells of the current row
+		rows are indexes of rows of the splits table to redraw."""
+		if region:
+			self._stale.add(region)
+		self._stale_rows.update(rows)
+		self._invalidated.set()
+
+	def redraw(self):
+		self.invalidate('all')
+
+	def draw_results(self):
+		"""Bring the results table up to date with self.results. For each result added since we last drew,
+		the current row is replaced by the result and we move on to the next line.
+		If the run has been reset, the results are erased.
+		Returns False if this can't be done without a full redraw."""
+		if self.results is None:
+			if self._drawn_results is None:
+				return True
+			layout = self.get_layout()
+			if layout[:2] != self._layout[:2]:
+				return False # splits table needs to change shape
+			self._layout = layout
+			self._drawn_results = None
+			self._drawn_prediction = None
+			# leave the cursor where preamble() would, after the blank lines following the splits table
+			_, count, _, _ = layout
+			self.out.write(MOVE_CURSOR.format(SPLITS_TOP + count) + CLEAR_BELOW + '\n\n')
+			return True
+		if self._drawn_results is None or self._drawn_results > len(self.results):
+			return False # a new run, or results were removed
+		while self._drawn_results < len(self.results):
+			index = self._drawn_results
+			row = self.compare(index, self.results[index])
+			self.out.write(CLEAR_LINE)
+			self.print_row(self.get_result_widths(self.get_visible_results() + [row]), row)
+			self._drawn_results += 1
+			# can we simply add the row below the others, or does the view need to scroll?
+			splits_start, splits_count, results_start, results_count = self._layout
+			layout = self.get_layout(self._drawn_results)
+			if layout != (splits_start, splits_count, results_start, results_count + 1):
+				return False
+			self._layout = layout
+		return True
+
+	def redraw_split_rows(self, indexes):
+		"""Re-write the given rows of the splits table in place, without disturbing the rest of the screen.
+		Returns False if this can't be done without a full redraw,
+		because the table's layout changed or the rows affect the current run."""
+		start, count, _, _ = self._layout
+		indexes = sorted(index for index in indexes if start <= index < start + count) # only those on screen
+		if not indexes:
+			return True
+		widths = self.get_splits_widths()
+		if widths != self._splits_widths or (self.results is not None and indexes[0] <= len(self.results)):
+			return False
+		self.out.write(SAVE_CURSOR)
+		for index in indexes:
+			self.out.write(MOVE_CURSOR.format(SPLITS_TOP + index - start) + CLEAR_LINE)
+			self.print_row(widths, self.splits_row(index), newline=False)
+		self.out.write(RESTORE_CURSOR)
+		return True
+
+	def render(self):
+		"""Bring the screen up to date with whatever has been invalidated since the last render,
+		doing as little as possible. In particular, if only the time has changed then no comparisons
+		or widths are calculated."""
+		with self._output_lock:
+			stale, self._stale = self._stale, set()
+			rows, self._stale_rows = self._stale_rows, set()
+			writes = self.out.writes
+			full = 'all' in stale
+			if not full and 'results' in stale:
+				full = not self.draw_results()
+			if not full and rows:
+				full = not self.redraw_split_rows(rows)
+			if full:
+				self.out.take() # discard anything partially drawn, we're redrawing it anyway
+				self.clear()
+			elif self.timer and stale & {'results', 'current'}:
+				self.draw_current()
+			elif self.timer and 'time' in stale:
+				self.draw_time()
+			self.out.flush(droppable=(stale == {'time'} and not rows))
+			if 'results' in stale:
+				self.split_writes = self.out.writes - writes
+
 	def output_loop(self):
+		while True:
+			self._invalidated.wait()
+			self._invalidated.clear()
+			self.render()
+
+	def tick_loop(self):
+		"""While running, periodically mark the time as needing to be redrawn"""
 		while True:
 			self.running.wait()
-			with self._output_lock:
-				if not self.running.is_set():
-					# race cdn: we stopped running between running.wait() and now - do nothing
-					continue
-				# at this time we assume the cursor is at the end of print_current()/preamble()
-				# we clear the current line, and re-print it
-				sys.stdout.write(CLEAR_LINE)
-				self.print_current()
-				sys.stdout.flush()
-			gevent.sleep(self.INTERVAL)
+			self.invalidate('time')
+			self.sleep(self.config.interval)
 
 	def input_loop(self):
 		ACTION_MAP = {
 			'HELP': self.help,
 			'SAVE': self.save,
 			'QUIT':	self.quit,
-			'REDRAW': self.clear,
-			'SPLIT': self.split,
+			'REDRAW': self.redraw,
+			'PROFILE': self.profile,
+			'COMPARE': self.next_comparison,
 			'UNSPLIT': self.unsplit,
+			'STOP': self.reset,
+		}
+		# these take effect at the time the key was pressed, not when we get to them
+		TIMED_ACTION_MAP = {
+			'SPLIT': self.split,
 			'SKIP': self.skip,
 			'PAUSE': self.pause,
-			'STOP': self.reset,
 		}
 		while True:
-			action = self.get_input()
-			if action not in ACTION_MAP:
-				continue # unimplemented
-			ACTION_MAP[action]()
+			action, timestamp = self.get_input()
+			if action in TIMED_ACTION_MAP:
+				TIMED_ACTION_MAP[action](timestamp)
+			elif action in ACTION_MAP:
+				ACTION_MAP[action]()
+			# otherwise, unimplemented
@@ -0,0 +1,98 @@
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+import gevent.select
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 04000
+IN_CLOEXEC = 02000000
+
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+class Inotify(object):
+	"""Thin wrapper around an inotify fd, watching a single directory.
+	Use wait() to cooperatively block until events arrive, and read() to get them."""
+
+	def __init__(self, path, mask):
+		self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+		if _libc.inotify_add_watch(self.fd, path, mask) < 0:
+			err = ctypes.get_errno()
+			os.close(self.fd)
+			raise OSError(err, 'Cannot watch {}: {}'.format(path, os.strerror(err)))
+
+	def wait(self, timeout=None):
+		"""Block until the fd is readable or timeout expires. Returns whether it is readable."""
+		while True:
+			try:
+				r, w, x = gevent.select.select([self.fd], [], [], timeout)
+			except EnvironmentError as ex:
+				if ex.errno != errno.EINTR:
+					raise
+				continue
+			return bool(r)
+
+	def read(self):
+		"""Return a list of (mask, name) for all pending events, without blocking"""
+		try:
+			data = os.read(self.fd, 64 * 1024)
+		except OSError as ex:
+			if ex.errno == errno.EAGAIN:
+				return []
+			raise
+		events = []
+		while data:
+			wd, mask, cookie, length = EVENT_HEADER.unpack_from(data)
+			end = EVENT_HEADER.size + length
+			name = data[EVENT_HEADER.size:end].rstrip('\0')
+			events.append((mask, name))
+			data = data[end:]
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+
+class FileWatcher(object):
+	"""Watches a single file for changes, including the write-to-temp-and-rename
+	pattern most editors use. We watch the containing directory so that the watch survives
+	the file being replaced."""
+	MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+	SETTLE_TIME = 0.1 # how long the file must be quiet before we report a change
+
+	def __init__(self, filepath):
+		filepath = os.path.abspath(filepath)
+		self.dirname, self.basename = os.path.split(filepath)
+		self.inotify = Inotify(self.dirname, self.MASK)
+
+	def _relevant(self):
+		return any(name == self.basename for mask, name in self.inotify.read())
+
+	def wait(self):
+		"""Block until the file has changed. Bursts of writes (eg. an editor writing a backup,
+		then the file, then touching it) are coalesced into a single change."""
+		while True:
+			self.inotify.wait()
+			if self._relevant():
+				break
+		# keep draining until things go quiet
+		while self.inotify.wait(self.SETTLE_TIME):
+			self.inotify.read()
+
+	def close(self):
+		self.inotify.close()
@@ -0,0 +1,232 @@
+"""Replay hours of simulated use of the UI as fast as possible, to check memory stays bounded over long sessions.
+
+Run as python -m tests.soak from the top of the repo. test_soak.py runs a short version as part of the tests.
+"""
+
+import gc
+import os
+import heapq
+import random
+import shutil
+import tempfile
+import itertools
+
+import gevent
+import gevent.event
+from argh import CommandError, arg, dispatch_command
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None # python 2, fall back to counting objects
+
+from termsplit.readers import add_reader
+from termsplit.timing import SECOND, monotonic_ns
+from termsplit.splits import Splits
+from termsplit.config import Config
+from termsplit.output import NonBlockingFrameBuffer
+from termsplit.ui import UI
+
+
+HEAP_UNIT = 'bytes' if tracemalloc else 'objects' # see heap_size()
+
+
+def percentile(values, fraction):
+	"""Return the value which fraction of the (sorted) values are at or below"""
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def rss():
+	"""Return the resident set size of this process, in bytes"""
+	with open('/proc/self/statm') as f:
+		return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def heap_size():
+	"""Return a measure of live python memory: traced bytes if tracemalloc is available,
+	otherwise the number of objects tracked by the garbage collector."""
+	gc.collect()
+	if tracemalloc:
+		current, peak = tracemalloc.get_traced_memory()
+		return current
+	return len(gc.get_objects())
+
+
+def synthetic_inputs(rng, num_segments, start):
+	"""Yield (timestamp, action) of an endless series of attempts, starting at the given time.
+	Attempts are usually completed, but are sometimes abandoned part way through,
+	and include the occasional pause, skip and unsplit. The splits are saved after each attempt."""
+	means = [rng.uniform(30, 120) * SECOND for _ in range(num_segments)]
+	now = start
+	while True:
+		yield now, 'SPLIT' # start
+		abandon_at = rng.randrange(num_segments) if rng.random() < 0.3 else None
+		for index, mean in enumerate(means):
+			if index == abandon_at:
+				break
+			now += max(SECOND, int(rng.gauss(mean, mean / 5)))
+			if rng.random() < 0.02:
+				yield now, 'PAUSE'
+				now += rng.randrange(10, 600) * SECOND
+				yield now, 'PAUSE'
+			if index < num_segments - 1 and rng.random() < 0.01:
+				yield now, 'SKIP'
+				continue
+			yield now, 'SPLIT'
+			if rng.random() < 0.01:
+				now += SECOND
+				yield now, 'UNSPLIT'
+				now += SECOND
+				yield now, 'SPLIT'
+		now += rng.randrange(5, 120) * SECOND
+		yield now, 'STOP'
+		now += SECOND
+		yield now, 'SAVE'
+		now += rng.randrange(5, 60) * SECOND
+
+
+class SimulatedClock(object):
+	"""A clock and sleep() for the UI (see UI.clock and UI.sleep) in which time only passes when advance()d.
+	Sleepers are woken in order as time passes them, and everything they set off is run to completion
+	before time moves on, so the UI's own loops run as they would in real time, only faster."""
+
+	def __init__(self):
+		self.now = 0
+		self._sleepers = [] # heap of (wake time, sequence number, Event)
+		self._sequence = itertools.count()
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		event = gevent.event.Event()
+		heapq.heappush(self._sleepers, (self.now + int(seconds * SECOND), next(self._sequence), event))
+		event.wait()
+
+	def advance(self, until):
+		gevent.idle()
+		while self._sleepers and self._sleepers[0][0] <= until:
+			wake, _, event = heapq.heappop(self._sleepers)
+			self.now = max(self.now, wake)
+			event.set()
+			gevent.idle()
+		self.now = max(self.now, until)
+
+
+class SoakFailure(Exception):
+	pass
+
+
+def soak(hours=24, num_segments=20, frame_interval=1, sample_interval=3600, seed=0, tolerance=0.1):
+	"""Replay hours of simulated use of the UI as fast as possible. The UI runs its real input, output and tick
+	loops, but against a simulated clock (see SimulatedClock), with synthetic input (see synthetic_inputs())
+	and a refresh rate of one frame every frame_interval simulated seconds. Output goes through a
+	NonBlockingFrameBuffer to a pipe that is drained and discarded. The splits, history and journal are
+	in a temporary directory.
+
+	Yields a dict for every sample_interval simulated seconds, describing the memory use at the end of it
+	and the real time taken to draw its frames. Memory use is compared to that after the first interval,
+	when caches and the like should have reached their steady state. If it has grown by more than
+	the given fraction, SoakFailure is raised."""
+	if tracemalloc:
+		tracemalloc.start()
+	rng = random.Random(seed)
+	tmpdir = tempfile.mkdtemp(prefix='termsplit-soak-')
+	read_fd, write_fd = os.pipe()
+	drain = add_reader(read_fd, lambda: os.read(read_fd, 64 * 1024))
+	ui = None
+	try:
+		filepath = os.path.join(tmpdir, 'soak.splits')
+		splits = Splits()
+		for index in range(num_segments):
+			splits.append('Segment {}'.format(index + 1), None, None)
+		splits.savefile(filepath)
+
+		ui = UI(Config({'refresh_rate': 1. / frame_interval}), Splits(filepath), filepath)
+		ui.out = NonBlockingFrameBuffer(write_fd, on_overflow=lambda: ui._input_queue.put(('REDRAW', None)))
+		clock = SimulatedClock()
+		ui.clock = clock
+		ui.sleep = clock.sleep
+		frame_times = []
+		render = ui.render
+		def timed_render():
+			start = monotonic_ns()
+			render()
+			frame_times.append(monotonic_ns() - start)
+		ui.render = timed_render
+		ui.clear()
+		for loop in (ui.input_loop, ui.output_loop, ui.tick_loop):
+			ui._group.spawn(loop)
+
+		inputs = synthetic_inputs(rng, num_segments, SECOND)
+		baseline = None
+		for sample in range(1, int(hours * 3600 / sample_interval) + 1):
+			end = sample * int(sample_interval * SECOND)
+			while True:
+				timestamp, action = next(inputs)
+				clock.advance(min(timestamp, end))
+				if timestamp > end:
+					break
+				ui._input_queue.put((action, timestamp))
+			inputs = itertools.chain([(timestamp, action)], inputs) # not yet due
+			for greenlet in ui._group.greenlets:
+				if greenlet.dead:
+					greenlet.get() # raise whatever killed it
+			frame_times.sort()
+			result = {
+				'hours': sample * sample_interval / 3600.,
+				'rss': rss(),
+				'heap': heap_size(),
+				'queued': ui._input_queue.qsize(),
+				'frames': len(frame_times),
+				'frame_median': percentile(frame_times, 0.5) if frame_times else 0,
+				'frame_99': percentile(frame_times, 0.99) if frame_times else 0,
+				'frame_max': frame_times[-1] if frame_times else 0,
+				'dropped': ui.out.dropped,
+			}
+			del frame_times[:]
+			yield result
+			if baseline is None:
+				baseline = result
+				continue
+			for key in ('rss', 'heap'):
+				if result[key] > baseline[key] * (1 + tolerance):
+					raise SoakFailure('{} grew from {} to {} after {} hours'.format(
+						key, baseline[key], result[key], result['hours'],
+					))
+	finally:
+		if ui:
+			ui._group.kill()
+			ui.journal.close()
+			ui.out.close()
+		drain.stop()
+		os.close(read_fd)
+		os.close(write_fd)
+		shutil.rmtree(tmpdir)
+		if tracemalloc:
+			tracemalloc.stop()
+
+
+@arg('--hours', type=float, help='Simulated time to run for')
+@arg('--segments', type=int, help='Number of segments in the simulated splits')
+@arg('--frame-interval', type=float, help='Simulated seconds between frames')
+@arg('--sample-interval', type=float, help='Simulated seconds between reports')
+@arg('--seed', type=int, help='Seed for the synthetic input')
+@arg('--tolerance', type=float, help='Fail if memory use grows by more than this fraction')
+def main(hours=24, segments=20, frame_interval=1, sample_interval=3600, seed=0, tolerance=0.1):
+	"""Simulate a long session (eg. a 24h marathon) as fast as possible, reporting memory use and
+	frame times as it goes, and fail if memory use grows."""
+	try:
+		for sample in soak(hours, segments, frame_interval, sample_interval, seed, tolerance):
+			print '{hours:6.1f}h: rss {rss_mb:.1f}MB, heap {heap} {heap_unit}, {queued} queued inputs; {frames} frames ({dropped} dropped in total): median {median:.1f}us, 99% {p99:.1f}us, max {max:.1f}us'.format(
+				rss_mb=sample['rss'] / 2.**20, heap_unit=HEAP_UNIT,
+				median=sample['frame_median'] / 1e3, p99=sample['frame_99'] / 1e3, max=sample['frame_max'] / 1e3,
+				**sample
+			)
+	except SoakFailure as ex:
+		raise CommandError('Memory use is not stable: {}'.format(ex))
+	print 'Memory use was stable'
+
+
+if __name__ == '__main__':
+	dispatch_command(main)
@@ -0,0 +1,34 @@
+import pytest
+
+from termsplit.config import Config
+
+
+def test_defaults():
+	config = Config()
+	assert config.precision == 3
+	assert config.collapse_groups is True
+
+
+def test_values():
+	config = Config({'refresh_rate': 30, 'precision': 2, 'columns': ['seg', 'time'], 'collapse_groups': False})
+	assert config.refresh_rate == 30.
+	assert config.precision == 2
+	assert config.columns == ('seg', 'time')
+	assert config.collapse_groups is False
+
+
+@pytest.mark.parametrize('data', [
+	{'collapse_groups': 'false'},
+	{'collapse_groups': 0},
+	{'precision': 2.7},
+	{'precision': True},
+	{'precision': '2'},
+	{'refresh_rate': '30'},
+	{'columns': 'name'},
+	{'comparisons': [1]},
+	{'comparisons': [['pb']]},
+	{'comparisons': []},
+])
+def test_bad_values(data):
+	with pytest.raises(ValueError):
+		Config(data)
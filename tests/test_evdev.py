@@ -0,0 +1,24 @@
+from termsplit import evdev
+
+
+def test_key_devices_hotplug(tmpdir, monkeypatch):
+	monkeypatch.setattr(evdev, 'DEVICE_DIR', str(tmpdir))
+	monkeypatch.setattr(evdev, 'has_keys', lambda name: name != 'event9')
+	tmpdir.join('event0').write('')
+	tmpdir.join('mouse0').write('')
+	added = []
+	removed = []
+	devices = evdev.KeyDevices(
+		on_add=lambda device: added.append(device.name),
+		on_remove=lambda device: removed.append(device.name),
+	)
+	assert added == ['event0']
+	tmpdir.join('event1').write('')
+	tmpdir.join('event9').write('') # no keys
+	tmpdir.join('event0').remove()
+	devices.update()
+	assert sorted(devices.devices) == ['event1']
+	assert added == ['event0', 'event1']
+	assert removed == ['event0']
+	devices.close()
+	assert removed == ['event0', 'event1']
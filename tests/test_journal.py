@@ -0,0 +1,90 @@
+import gevent
+import pytest
+
+from termsplit.timing import SECOND
+from termsplit.journal import Journal, boot_id, wall_ns
+from termsplit.splits import Splits
+from termsplit.config import Config
+from termsplit.ui import UI
+
+
+@pytest.fixture
+def splitfile(tmpdir):
+	path = str(tmpdir.join('test.splits'))
+	splits = Splits()
+	for name in ('one', 'two', 'three'):
+		splits.append(name, None, None)
+	splits.savefile(path)
+	return path
+
+
+def write_journal(path, events):
+	"""Write a journal as if by an earlier run on this boot, with timestamps in seconds"""
+	with open(path, 'w') as f:
+		f.write('clock\t{}\t{}\t{}\n'.format(boot_id(), wall_ns(), 0))
+		for event, seconds in events:
+			f.write('{}\t{}\n'.format(event, seconds * SECOND))
+
+
+def restore(splitfile, events):
+	ui = UI(Config(), Splits(splitfile), splitfile)
+	write_journal(ui.journal.path, events)
+	ui.restore(ui.journal.read())
+	ui.journal.close()
+	return ui
+
+
+def test_round_trip(tmpdir):
+	journal = Journal(str(tmpdir.join('test.journal')))
+	journal.begin()
+	journal.record('start', 1)
+	journal.record('mark', 2)
+	gevent.sleep(0.1) # let it flush
+	journal.record('pause', 3)
+	gevent.sleep(0.1)
+	journal.close()
+	assert journal.read() == [('start', 1), ('mark', 2), ('pause', 3)]
+	journal.discard()
+	assert journal.read() is None
+
+
+def test_close_writes_pending(tmpdir):
+	journal = Journal(str(tmpdir.join('test.journal')))
+	journal.begin()
+	journal.record('start', 1)
+	gevent.sleep(0) # flusher writes, and starts syncing
+	journal.record('pause', 2) # arrives while the sync is in flight
+	journal.close()
+	assert journal.read() == [('start', 1), ('pause', 2)]
+
+
+def test_restore_in_progress(splitfile):
+	ui = restore(splitfile, [('start', 10), ('mark', 11), ('skip', 13), ('pause', 14)])
+	assert [time for name, seg, time in ui.results] == [1 * SECOND, None]
+	assert ui.timer.paused
+	assert ui.timer.get() == 4 * SECOND
+	assert not ui.running.is_set()
+
+
+def test_restore_unmark(splitfile):
+	ui = restore(splitfile, [('start', 10), ('mark', 11), ('mark', 13), ('unmark', 14), ('mark', 16)])
+	assert [seg for name, seg, time in ui.results] == [1 * SECOND, 5 * SECOND]
+	assert ui.timer and ui.running.is_set()
+
+
+def test_restore_finished_but_not_reset(splitfile):
+	events = [('start', 10), ('mark', 11), ('mark', 13), ('mark', 16), ('finish', 16)]
+	ui = restore(splitfile, events)
+	assert ui.timer is None
+	assert not ui.running.is_set()
+	assert [time for name, seg, time in ui.results] == [1 * SECOND, 3 * SECOND, 6 * SECOND]
+	# and it can be reset as normal
+	ui.reset()
+	assert ui.results is None
+	assert [time for name, best, time in ui.splits] == [1 * SECOND, 3 * SECOND, 6 * SECOND]
+
+
+def test_restore_without_finish(splitfile):
+	ui = restore(splitfile, [('start', 10), ('mark', 11), ('mark', 13), ('mark', 16)])
+	assert ui.timer is None
+	assert len(ui.results) == 3
@@ -0,0 +1,106 @@
+import os
+import fcntl
+import socket
+
+import gevent
+
+from termsplit.output import FrameBuffer, NonBlockingFrameBuffer
+
+
+F_SETPIPE_SZ = 1031 # from linux's fcntl.h, not exposed by python 2's fcntl module
+
+
+def read_all(fd):
+	"""Read whatever is waiting on a non-blocking fd"""
+	data = ''
+	while True:
+		try:
+			chunk = os.read(fd, 65536)
+		except OSError:
+			return data
+		if not chunk:
+			return data
+		data += chunk
+
+
+def read_until(fd, size, timeout=1):
+	"""Read from a non-blocking fd, letting the writer run, until at least size bytes arrive or timeout"""
+	data = ''
+	with gevent.Timeout(timeout, False):
+		while len(data) < size:
+			data += read_all(fd)
+			gevent.sleep(0.01)
+	return data
+
+
+def test_frame_is_one_write():
+	read_fd, write_fd = os.pipe()
+	out = FrameBuffer(write_fd)
+	out.write('a')
+	out.writeline('b')
+	out.flush()
+	out.flush() # empty frames aren't written
+	assert os.read(read_fd, 100) == 'ab\n'
+	assert (out.frames, out.writes, out.bytes) == (1, 1, 3)
+
+
+def test_nonblocking_leaves_shared_terminal_blocking():
+	master, slave = os.openpty()
+	stdin = os.dup(slave) # shares slave's open file, as stdin and stdout of a terminal do
+	out = NonBlockingFrameBuffer(slave)
+	assert not fcntl.fcntl(slave, fcntl.F_GETFL) & os.O_NONBLOCK
+	assert not fcntl.fcntl(stdin, fcntl.F_GETFL) & os.O_NONBLOCK
+	assert fcntl.fcntl(out.fd, fcntl.F_GETFL) & os.O_NONBLOCK
+	out.write('hello')
+	out.flush()
+	out.close()
+	assert os.read(master, 100) == 'hello'
+
+
+def stalled_output(max_pending):
+	"""Return (NonBlockingFrameBuffer writing to a pipe nobody is reading yet, list of overflow calls,
+	non-blocking read end of the pipe)"""
+	read_fd, write_fd = os.pipe()
+	fcntl.fcntl(write_fd, F_SETPIPE_SZ, 4096) # so the pipe fills quickly
+	fcntl.fcntl(read_fd, fcntl.F_SETFL, os.O_NONBLOCK)
+	overflows = []
+	out = NonBlockingFrameBuffer(write_fd, on_overflow=lambda: overflows.append(1))
+	out.MAX_PENDING = max_pending
+	return out, overflows, read_fd
+
+
+def test_droppable_frames_are_superseded():
+	out, overflows, read_fd = stalled_output(1024 * 1024)
+	out.write('x' * 8192) # fill the pipe
+	out.flush()
+	gevent.sleep(0.01)
+	for frame in range(5):
+		out.write(str(frame))
+		out.flush(droppable=True)
+	assert out.dropped == 4
+	assert read_until(read_fd, 8192 + 1) == 'x' * 8192 + '4'
+	assert not overflows
+
+
+def test_full_frame_always_let_through():
+	out, overflows, read_fd = stalled_output(100)
+	out.write('x' * 8192)
+	out.flush(full=True) # bigger than MAX_PENDING, but still sent
+	gevent.sleep(0.01)
+	out.write('y' * 200)
+	out.flush()
+	assert overflows == [1] # too big, and not a full redraw
+	out.write('z' * 8192)
+	out.flush(full=True)
+	assert not overflows[1:]
+	assert read_until(read_fd, 8192 * 2) == 'x' * 8192 + 'z' * 8192
+
+
+def test_nonblocking_socket():
+	sock, peer = socket.socketpair()
+	out = NonBlockingFrameBuffer(sock.fileno())
+	assert fcntl.fcntl(out.fd, fcntl.F_GETFL) & os.O_NONBLOCK
+	out.write('hello')
+	out.flush()
+	out.close()
+	assert peer.recv(100) == 'hello'
@@ -0,0 +1,41 @@
+from termsplit.sketch import QuantileSketch
+from termsplit.predict import Predictor, SegmentDistribution
+from termsplit.timing import SECOND
+
+
+def sketch(*seconds):
+	result = QuantileSketch()
+	for value in seconds:
+		result = result.with_value(value * SECOND)
+	return result
+
+
+def predictor(sketches):
+	return Predictor([SegmentDistribution(sketch) for sketch in sketches])
+
+
+def test_moving_between_segments_matches_a_fresh_predictor():
+	sketches = [sketch(10 + index, 12 + index, 15 + index) for index in range(10)]
+	fresh = [predictor(sketches).predict(index, 0, 0, 100 * SECOND) for index in range(10)]
+	moving = predictor(sketches)
+	for index in range(10) + [3, 2, 0, 8]: # splits, then unsplits and a reset
+		assert moving.predict(index, 0, 0, 100 * SECOND) == fresh[index]
+
+
+def test_update():
+	sketches = [sketch(10, 20) for index in range(5)]
+	moving = predictor(sketches)
+	moving.predict(2, 0, 0)
+	for index in (1, 4):
+		sketches[index] = sketch(30, 40)
+		moving.update(index, sketches[index])
+	for index in range(5):
+		assert moving.predict(index, 0, 0) == predictor(sketches).predict(index, 0, 0)
+
+
+def test_unknown_segment():
+	moving = predictor([sketch(10), None, sketch(10)])
+	assert moving.predict(0, 0, 0) is None # a later segment has no history
+	projected, chance = moving.predict(2, 50 * SECOND, 0, 40 * SECOND)
+	assert projected == 60 * SECOND
+	assert chance == 0
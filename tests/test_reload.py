@@ -0,0 +1,72 @@
+import pytest
+
+from termsplit.splits import Splits
+from termsplit.config import Config
+from termsplit.ui import UI
+
+
+@pytest.fixture
+def ui(tmpdir):
+	path = str(tmpdir.join('test.splits'))
+	with open(path, 'w') as f:
+		f.write('one\t00:10.000\t00:10.000\ntwo\t00:10.000\t00:20.000\n')
+	ui = UI(Config(), Splits(path), path)
+	ui.sleep = lambda seconds: None
+	return ui
+
+
+def edit(ui, data):
+	with open(ui.filepath, 'w') as f:
+		f.write(data)
+	ui.reload()
+
+
+def read(ui):
+	with open(ui.filepath) as f:
+		return f.read()
+
+
+def test_changed_line(ui):
+	edit(ui, 'one\t00:09.000\t00:10.000\ntwo\t00:10.000\t00:20.000\n')
+	assert ui.splits[0] == ('one', 9 * 10**9, 10 * 10**9)
+	assert ui.saved == ui.splits
+
+
+def test_structural_edit_is_deferred_during_run(ui):
+	ui.start()
+	edit(ui, 'one\t00:10.000\t00:10.000\ntwo\t00:10.000\t00:20.000\nthree\t\t\n')
+	assert len(ui.splits) == 2
+	ui.reset() # abandoned without splitting, so nothing to save
+	assert len(ui.splits) == 3
+
+
+def test_save_does_not_silently_overwrite_pending_edit(ui):
+	ui.start()
+	ui.split()
+	ui.reset() # unsaved changes
+	edited = 'one\t00:10.000\t00:10.000\ntwo\t00:10.000\t00:20.000\nthree\t\t\n'
+	edit(ui, edited)
+	assert ui._reload_pending
+	ui._input_queue.put(('SPLIT', None))
+	ui.save()
+	assert read(ui) == edited # cancelled
+	assert ui.get_input() == ('SPLIT', None) # and the input was left for the input loop
+	ui._input_queue.put(('SAVE', None))
+	ui.save()
+	assert read(ui) != edited # confirmed
+	assert ui._input_queue.qsize() == 0
+
+
+def test_hand_written_file_only_changed_lines(ui):
+	with open(ui.filepath, 'w') as f:
+		f.write('one\t10\t10\n\ntwo\t0:10\t0:20\n') # not as we would write it
+	ui = UI(Config(), Splits(ui.filepath), ui.filepath)
+	sketches = [object(), object()] # as if seeded from history
+	ui.splits.sketches = list(sketches)
+	ui.saved.sketches = list(sketches)
+	two = ui.splits[1]
+	edit(ui, 'one\t9\t10\n\ntwo\t0:10\t0:20\n')
+	assert ui.splits[0] == ('one', 9 * 10**9, 10 * 10**9)
+	assert ui.splits[1] is two # not re-parsed
+	assert ui.splits.sketches == sketches # the file has none, so they are kept
+	assert ui.saved == ui.splits
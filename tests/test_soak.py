@@ -0,0 +1,8 @@
+from tests.soak import soak
+
+
+def test_memory_is_stable():
+	samples = list(soak(hours=3, num_segments=5, sample_interval=1800))
+	assert len(samples) == 6
+	assert all(sample['frames'] for sample in samples)
+	assert all(sample['queued'] == 0 for sample in samples)
@@ -0,0 +1,119 @@
+import pytest
+
+from termsplit.timing import SECOND
+from termsplit.sketch import QuantileSketch
+from termsplit.history import History, usable_segments
+from termsplit.splits import Splits
+
+
+def make_splits(rows):
+	splits = Splits()
+	for name, best, time in rows:
+		splits.append(name, best, time)
+	return splits
+
+
+def test_usable_segments():
+	assert usable_segments([1, None, 3, 4, None, None, 7]) == [1, None, None, 4, None, None, None]
+
+
+def test_merge_segment_after_skip_is_not_a_gold():
+	splits = make_splits([('one', 10, 10), ('two', 10, 20), ('three', 10, 30)])
+	changes = splits.merge(make_splits([('one', 5, 5), ('two', None, None), ('three', 8, 13)]))
+	assert changes.golds == [(0, 10, 5)]
+	assert changes.sampled == [0]
+	assert changes.pb
+	assert list(splits) == [('one', 5, 5), ('two', 10, None), ('three', 10, 13)]
+
+
+def test_history_sketches_skip_segment_after_skip(tmpdir):
+	history = History(str(tmpdir.join('test.history')))
+	history.append([SECOND, None, 3 * SECOND])
+	history.append([2 * SECOND, 2 * SECOND])
+	one, two, three = history.sketches(3)
+	assert one.count == 2
+	assert two.count == 1
+	assert three is None
+
+
+GROUPED = '\n'.join([
+	'World 1',
+	'  1-1\t00:31.000\t00:31.000',
+	'  Castle',
+	'    1-2\t00:40.000\t01:11.000',
+	'    Boss\t00:10.000\t01:21.000',
+	'World 2',
+	'  2-1\t\t01:56.000',
+])
+
+
+def test_load_dump_grouped():
+	splits = Splits()
+	splits.load(GROUPED)
+	assert [name for name, best, time in splits] == ['1-1', '1-2', 'Boss', '2-1']
+	assert splits.groups == [('World 1', 0, 3, 0), ('Castle', 1, 3, 1), ('World 2', 3, 4, 0)]
+	assert splits.group_best(0) == 81 * SECOND
+	assert splits.group_best(2) is None
+	assert splits.dump() == GROUPED
+
+
+def test_load_hand_written():
+	splits = Splits()
+	splits.load('\n1-1\t31\t31\n\n1-2\t1:0:40\t\t00:40.000*1\n') # blank lines, old formats, and a sketch
+	assert list(splits) == [('1-1', 31 * SECOND, 31 * SECOND), ('1-2', 3640 * SECOND, None)]
+	assert splits.sketches[1].count == 1
+	assert splits.dump() == '1-1\t00:31.000\t00:31.000\n1-2\t01:00:40.000\t\t00:40.000*1'
+
+
+def test_group_cannot_have_times():
+	with pytest.raises(ValueError):
+		Splits().load('World 1\t00:10.000\t\n  1-1\t\t\n')
+
+
+def test_database_round_trip(tmpdir):
+	path = str(tmpdir.join('test.db'))
+	splits = Splits()
+	splits.load(GROUPED)
+	splits.set_sketch(0, QuantileSketch().with_value(31 * SECOND))
+	splits.savefile(path)
+	loaded = Splits(path)
+	assert loaded == splits
+	splits.merge(make_splits([('1-1', 30 * SECOND, 30 * SECOND)]))
+	splits.savefile(path)
+	assert Splits(path) == splits
+
+
+def write_marathon(tmpdir):
+	tmpdir.join('one.splits').write('a\t00:10.000\t00:10.000\nb\t00:10.000\t00:20.000\n')
+	tmpdir.join('two.splits').write('c\t00:05.000\t00:05.000\n')
+	path = tmpdir.join('run.marathon')
+	path.write('One\tone.splits\nTwo\ttwo.splits\n')
+	return str(path)
+
+
+def test_marathon_expand(tmpdir):
+	splits = Splits(write_marathon(tmpdir))
+	# the first game is loaded, the second is a single row until reached
+	assert list(splits) == [('a', 10 * SECOND, 10 * SECOND), ('b', 10 * SECOND, 20 * SECOND), ('Two', None, None)]
+	assert splits.groups == [('One', 0, 2, 0), ('Two', 2, 3, 0)]
+	assert splits.expand(2)
+	assert not splits.expand(2)
+	assert list(splits)[2] == ('c', 5 * SECOND, 25 * SECOND)
+	assert splits.groups == [('One', 0, 2, 0), ('Two', 2, 3, 0)]
+
+
+def test_marathon_savefile(tmpdir):
+	path = write_marathon(tmpdir)
+	splits = Splits(path)
+	splits.expand(2)
+	changes = splits.merge(make_splits([('a', 9 * SECOND, 9 * SECOND), ('b', 10 * SECOND, 19 * SECOND), ('c', 4 * SECOND, 23 * SECOND)]))
+	assert changes.pb
+	assert changes.golds == [(0, 10 * SECOND, 9 * SECOND), (2, 5 * SECOND, 4 * SECOND)]
+	splits.savefile(path)
+	assert tmpdir.join('one.splits').read() == 'a\t00:09.000\t00:09.000\t00:09.000*1\nb\t00:10.000\t00:19.000\t00:10.000*1\n'
+	assert tmpdir.join('two.splits').read() == 'c\t00:04.000\t00:04.000\t00:04.000*1\n'
+	assert tmpdir.join('run.marathon').read() == 'One\tone.splits\t00:19.000\t00:19.000\nTwo\ttwo.splits\t00:04.000\t00:04.000\n'
+	reloaded = Splits(path) # totals come from the manifest until the game is loaded
+	assert list(reloaded)[2] == ('Two', 4 * SECOND, 23 * SECOND)
+	reloaded.expand(2)
+	assert reloaded == splits
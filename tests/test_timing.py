@@ -0,0 +1,46 @@
+import pytest
+
+from termsplit.timing import SECOND, parse_time, format_time
+
+
+@pytest.mark.parametrize('text, expected', [
+	('', None),
+	('0', 0),
+	('3661.05', 3661050000000), # seconds alone, as written by older versions
+	('1:1:1.05', 3661050000000),
+	('61:1.05', 3661050000000),
+	('01:01:01.050', 3661050000000),
+	('00:31.00', 31 * SECOND),
+	('1.5', 3 * SECOND / 2),
+	('.5', SECOND / 2),
+	('0.1234567891', 123456789), # past nanoseconds is dropped
+	('-00:05.500', -5500000000),
+])
+def test_parse(text, expected):
+	assert parse_time(text) == expected
+
+
+@pytest.mark.parametrize('text', ['abc', '1:2:3:4', '1.2.3', '1e3', ':', '1:-2'])
+def test_parse_invalid(text):
+	with pytest.raises(ValueError):
+		parse_time(text)
+
+
+@pytest.mark.parametrize('ns, precision, expected', [
+	(None, 3, ''),
+	(0, 3, '00:00.000'),
+	(3661050000000, 3, '01:01:01.050'),
+	(59999900000, 3, '01:00.000'), # rounds up into the next minute
+	(59999400000, 3, '00:59.999'),
+	(3599999600000, 3, '01:00:00.000'), # and the next hour
+	(59950000000, 1, '01:00.0'),
+	(59400000000, 0, '00:59'),
+	(-5500000000, 3, '-00:05.500'),
+])
+def test_format(ns, precision, expected):
+	assert format_time(ns, precision) == expected
+
+
+@pytest.mark.parametrize('ns', [0, 1000000, 59999000000, 60 * SECOND, 3661050000000, 100 * 3600 * SECOND, -5500000000])
+def test_round_trip(ns):
+	assert parse_time(format_time(ns)) == ns